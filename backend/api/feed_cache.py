@@ -0,0 +1,120 @@
+import re
+import threading
+from collections import OrderedDict
+from hashlib import md5
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+
+from api.relations import UserRelations, get_relations
+from recipes import catalogue
+
+PARAMS = frozenset(('tags', 'tags_mode', 'author', 'page', 'limit'))
+TAGS_MODES = ('any', 'all')
+SLUG_RE = re.compile(r'^[-a-zA-Z0-9_]+$')
+PAYLOAD_KEY = 'recipe_feed:{}'
+PAYLOAD_TIMEOUT = 60 * 10
+LOCAL_SIZE = 512
+
+
+class LRUCache:
+    """Потокобезопасный LRU-кэш в памяти процесса."""
+
+    def __init__(self, size):
+        self.size = size
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            if len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+local_cache = LRUCache(LOCAL_SIZE)
+
+
+def get_key(request):
+    """Ключ ленты по нормализованным параметрам и версиям её данных.
+
+    Возвращает None, если запрос нельзя отдать из кэша.
+    """
+    params = request.query_params
+    if not PARAMS.issuperset(params):
+        return None
+    tags = sorted(set(params.getlist('tags')))
+    tags_mode = params.get('tags_mode', TAGS_MODES[0])
+    authors = params.getlist('author')
+    numbers = authors + params.getlist('page') + params.getlist('limit')
+    if (len(authors) > 1
+            or tags_mode not in TAGS_MODES
+            or not all(value.isdigit() for value in numbers)
+            or not all(SLUG_RE.match(slug) for slug in tags)):
+        return None
+    names = [catalogue.FEED]
+    if authors or tags:
+        names += catalogue.feed_names(authors, tags)
+    else:
+        names.append(catalogue.FEED_ALL)
+    versions = catalogue.get_versions(*names)
+    normalized = [
+        request.get_host(),
+        ','.join(tags),
+        tags_mode,
+        ','.join(authors),
+        params.get('page', '1'),
+        params.get('limit', '')
+    ] + [str(versions[name]) for name in names]
+    return PAYLOAD_KEY.format(md5('|'.join(normalized).encode()).hexdigest())
+
+
+def load(key):
+    data = local_cache.get(key)
+    if data is None and settings.RECIPE_FEED_SHARED_CACHE:
+        data = cache.get(key)
+        if data is not None:
+            local_cache.set(key, data)
+    return data
+
+
+def store(key, data):
+    data = overlay(data, UserRelations(AnonymousUser()))
+    local_cache.set(key, data)
+    if settings.RECIPE_FEED_SHARED_CACHE:
+        cache.set(key, data, PAYLOAD_TIMEOUT)
+
+
+def overlay(data, relations):
+    """Копия страницы ленты с отметками пользователя из relations."""
+    results = []
+    for recipe in data['results']:
+        recipe = dict(recipe)
+        recipe['author'] = dict(recipe['author'])
+        recipe['author']['is_subscribed'] = (
+            recipe['author']['id'] in relations.following)
+        recipe['is_favorited'] = recipe['id'] in relations.favorites
+        recipe['is_in_shopping_cart'] = recipe['id'] in relations.shop_list
+        results.append(recipe)
+    data = OrderedDict(data)
+    data['results'] = results
+    return data
+
+
+def get_response_data(request, data):
+    if not request.user.is_authenticated:
+        return data
+    return overlay(data, get_relations(request))
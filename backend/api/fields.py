@@ -0,0 +1,61 @@
+from django.conf import settings
+from django.utils.encoding import filepath_to_uri
+from drf_extra_fields.fields import Base64ImageField
+from rest_framework.fields import Field
+
+from recipes.images import content_hash, has_variants
+
+
+def media_url(request):
+    """Базовый адрес медиафайлов, вычисляемый один раз на запрос."""
+    if settings.MEDIA_CDN_URL:
+        return settings.MEDIA_CDN_URL
+    if request is None:
+        return settings.MEDIA_URL
+    if not hasattr(request, 'media_url'):
+        request.media_url = request.build_absolute_uri(settings.MEDIA_URL)
+    return request.media_url
+
+
+def image_url(image, base_url):
+    if not image:
+        return None
+    return base_url + filepath_to_uri(image.name)
+
+
+def image_variant_urls(recipe, base_url):
+    if not has_variants(recipe):
+        return {}
+    return {width: base_url + filepath_to_uri(name)
+            for width, name in recipe.image_variants.items()}
+
+
+class HashedBase64ImageField(Base64ImageField):
+    """Картинка в base64 с именем файла по хэшу содержимого."""
+
+    def get_file_name(self, decoded_file):
+        return content_hash(decoded_file)
+
+
+class ImageUrlField(Field):
+    """Ссылка на файл для чтения, без обращения к хранилищу."""
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return image_url(value, media_url(self.context.get('request')))
+
+
+class ImageVariantsField(Field):
+    """Ссылки на уменьшенные копии фото рецепта по ширине."""
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        return image_variant_urls(recipe,
+                                  media_url(self.context.get('request')))
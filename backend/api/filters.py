@@ -13,28 +13,57 @@ class IngredientFilter(FilterSet):
 
 class RecipeFilter(FilterSet):
     tags = filters.ModelMultipleChoiceFilter(queryset=Tag.objects.all(),
-                                             field_name='tags__slug',
-                                             to_field_name='slug')
+                                             field_name='tags',
+                                             to_field_name='slug',
+                                             method='get_tags')
+    tags_mode = filters.ChoiceFilter(choices=(('any', 'Любой из тегов'),
+                                              ('all', 'Все теги')),
+                                     method='get_tags_mode')
     is_favorited = filters.BooleanFilter(
         method='get_is_favorited'
     )
     is_in_shopping_cart = filters.BooleanFilter(
         method='get_is_in_shopping_cart'
     )
+    search = filters.CharFilter(method='get_search')
+    ordering = filters.ChoiceFilter(choices=(('popular', 'Популярные'),
+                                             ('trending', 'В тренде')),
+                                    method='get_ordering')
 
     class Meta:
         model = Recipe
         fields = ('tags',
+                  'tags_mode',
                   'author',
                   'is_favorited',
-                  'is_in_shopping_cart')
+                  'is_in_shopping_cart',
+                  'search',
+                  'ordering')
+
+    def get_tags(self, queryset, name, value):
+        if not value:
+            return queryset
+        if self.form.cleaned_data.get('tags_mode') == 'all':
+            return queryset.with_all_tags(value)
+        return queryset.with_any_tag(value)
+
+    def get_tags_mode(self, queryset, name, value):
+        return queryset
 
     def get_is_in_shopping_cart(self, queryset, name, value):
         if value:
-            return queryset.filter(shop_list__user=self.request.user)
+            return queryset.filter(is_in_shopping_cart=True)
         return queryset
 
     def get_is_favorited(self, queryset, name, value):
         if value:
-            return queryset.filter(favorites__user=self.request.user)
+            return queryset.filter(is_favorited=True)
         return queryset
+
+    def get_search(self, queryset, name, value):
+        return queryset.search(value)
+
+    def get_ordering(self, queryset, name, value):
+        if value == 'trending':
+            return queryset.trending()
+        return queryset.popular()
@@ -0,0 +1,264 @@
+import base64
+import io
+import json
+import math
+import platform
+import time
+from itertools import cycle
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+
+from api import feed_cache, metrics, shopping_list
+from recipes.models import Ingredient, Recipe, Tag
+from users.models import User
+
+SCENARIOS = (
+    'recipes.list',
+    'recipes.retrieve',
+    'recipes.create',
+    'recipes.partial_update',
+    'recipes.download_shopping_cart',
+    'users.subscriptions',
+    'ingredients.search',
+)
+COMPARED = ('rps', 'p50_ms', 'p99_ms', 'queries')
+
+
+def percentile(values, percent):
+    """Перцентиль по ближайшему рангу, values отсортированы."""
+    rank = math.ceil(percent / 100 * len(values))
+    return values[max(rank - 1, 0)]
+
+
+def image_payload():
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), (230, 180, 120)).save(buffer, 'PNG')
+    return 'data:image/png;base64,{}'.format(
+        base64.b64encode(buffer.getvalue()).decode())
+
+
+class Command(BaseCommand):
+    help = ('Замер пропускной способности и задержек основных эндпоинтов '
+            'API с сохранением результата в JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed-data',
+                            action='store_true',
+                            help='Перед замером добавить данные через '
+                                 'generate_data. Данные остаются в базе, а у '
+                                 'пользователей известный пароль: только '
+                                 'для отдельной базы замеров')
+        parser.add_argument('--users', type=int, default=200,
+                            help='Сколько пользователей добавить '
+                                 'с --seed-data')
+        parser.add_argument('--recipes', type=int, default=2000,
+                            help='Сколько рецептов добавить с --seed-data')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Запросов на сценарий')
+        parser.add_argument('--warmup', type=int, default=10,
+                            help='Запросов на прогрев перед замером')
+        parser.add_argument('--scenario',
+                            action='append',
+                            choices=SCENARIOS,
+                            help='Сценарий, можно указать несколько раз')
+        parser.add_argument('--warm',
+                            action='store_true',
+                            help='Не сбрасывать кэши ленты и списка покупок '
+                                 'перед запросами')
+        parser.add_argument('--output', default='benchmark.json')
+        parser.add_argument('--baseline',
+                            help='JSON прошлого замера для сравнения')
+        parser.add_argument('--max-regression', type=float,
+                            help='Допустимое ухудшение p50 в процентах')
+
+    def handle(self, *args, **options):
+        if options['max_regression'] is not None and not options['baseline']:
+            raise CommandError('--max-regression требует --baseline')
+        if settings.DEBUG:
+            print('DEBUG включён: Django сохраняет каждый запрос к базе, '
+                  'замеры будут завышены')
+        if options['seed_data']:
+            call_command('generate_data',
+                         users=options['users'],
+                         recipes=options['recipes'],
+                         seed=options['seed'])
+
+        self.warm = options['warm']
+        self.user = (User.objects.filter(shop_list__isnull=False,
+                                         follower__isnull=False).first()
+                     or User.objects.filter(shop_list__isnull=False).first())
+        if self.user is None or not Recipe.objects.exists():
+            raise CommandError('Нет данных: запустите generate_data или '
+                               'добавьте --seed-data')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.image = image_payload()
+        self.created = []
+
+        results = {}
+        try:
+            with override_settings(RECIPE_FEED_SHARED_CACHE=False):
+                for name in options['scenario'] or SCENARIOS:
+                    request = getattr(self, name.replace('.', '_'))()
+                    results[name] = self.measure(request,
+                                                 options['requests'],
+                                                 options['warmup'])
+                    print('{:32} {rps:8.1f} запр/с  p50 {p50_ms:7.2f} мс  '
+                          'p99 {p99_ms:7.2f} мс  запросов к БД {queries:.1f}'
+                          .format(name, **results[name]))
+        finally:
+            Recipe.objects.filter(id__in=self.created).delete()
+
+        report = {
+            'created': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'debug': settings.DEBUG,
+            'warm': self.warm,
+            'dataset': {
+                'users': User.objects.count(),
+                'recipes': Recipe.objects.count(),
+                'ingredients': Ingredient.objects.count(),
+            },
+            'scenarios': results,
+        }
+        with open(options['output'], 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        print('Результат сохранён в {}'.format(options['output']))
+        if options['baseline']:
+            self.compare(results, options['baseline'],
+                         options['max_regression'])
+
+    def measure(self, request, count, warmup):
+        for _ in range(warmup):
+            request()
+        durations = []
+        stats = metrics.RequestStats()
+        with metrics.collect(stats):
+            started = time.perf_counter()
+            for _ in range(count):
+                request_started = time.perf_counter()
+                request()
+                durations.append(time.perf_counter() - request_started)
+            elapsed = time.perf_counter() - started
+        durations.sort()
+        return {
+            'requests': count,
+            'rps': count / elapsed,
+            'mean_ms': sum(durations) / count * 1000,
+            'p50_ms': percentile(durations, 50) * 1000,
+            'p99_ms': percentile(durations, 99) * 1000,
+            'queries': stats.queries / count,
+        }
+
+    def call(self, method, url, expected, **kwargs):
+        response = getattr(self.client, method)(url, **kwargs)
+        if response.status_code != expected:
+            raise CommandError('{} {} ответил {}: {}'.format(
+                method.upper(), url, response.status_code,
+                response.content[:300]))
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response
+
+    def reset_feed(self):
+        if not self.warm:
+            feed_cache.local_cache.clear()
+
+    def recipes_list(self):
+        pages = cycle(range(1, 51))
+
+        def request():
+            self.reset_feed()
+            self.call('get', '/api/recipes/?page={}'.format(next(pages)), 200)
+        return request
+
+    def recipes_retrieve(self):
+        ids = cycle(Recipe.objects.order_by('-pub_date').values_list(
+            'id', flat=True)[:500])
+        return lambda: self.call('get',
+                                 '/api/recipes/{}/'.format(next(ids)),
+                                 200)
+
+    def recipe_payload(self, offset):
+        ingredients = Ingredient.objects.order_by('id').values_list(
+            'id', flat=True)[offset:offset + 6]
+        return {
+            'name': 'Замер {}'.format(offset),
+            'text': 'Рецепт для замера',
+            'cooking_time': 10 + offset,
+            'image': self.image,
+            'tags': list(Tag.objects.order_by('id').values_list(
+                'id', flat=True)[offset:offset + 2]),
+            'ingredients': [{'id': pk, 'amount': 10 + offset}
+                            for pk in ingredients],
+        }
+
+    def recipes_create(self):
+        payload = self.recipe_payload(0)
+
+        def request():
+            response = self.call('post', '/api/recipes/', 201,
+                                 data=payload, format='json')
+            self.created.append(response.data['id'])
+        return request
+
+    def recipes_partial_update(self):
+        recipe_id = self.call('post', '/api/recipes/', 201,
+                              data=self.recipe_payload(0),
+                              format='json').data['id']
+        self.created.append(recipe_id)
+        payloads = cycle((self.recipe_payload(1), self.recipe_payload(0)))
+        return lambda: self.call('patch',
+                                 '/api/recipes/{}/'.format(recipe_id),
+                                 200,
+                                 data=next(payloads),
+                                 format='json')
+
+    def recipes_download_shopping_cart(self):
+        def request():
+            if not self.warm:
+                shopping_list.invalidate(self.user.id)
+            self.call('get', '/api/recipes/download_shopping_cart/', 200)
+        return request
+
+    def users_subscriptions(self):
+        return lambda: self.call(
+            'get', '/api/users/subscriptions/?recipes_limit=3', 200)
+
+    def ingredients_search(self):
+        prefixes = cycle(sorted({
+            name[:2] for name in Ingredient.objects.values_list(
+                'name', flat=True)[:200]
+        }))
+        return lambda: self.call(
+            'get', '/api/ingredients/?name={}'.format(next(prefixes)), 200)
+
+    @staticmethod
+    def compare(results, path, max_regression):
+        with open(path, encoding='utf-8') as file:
+            baseline = json.load(file)['scenarios']
+        regressions = []
+        print('\nСравнение с {}'.format(path))
+        for name, current in results.items():
+            if name not in baseline:
+                continue
+            changes = []
+            for key in COMPARED:
+                before, after = baseline[name][key], current[key]
+                if before:
+                    change = (after - before) / before * 100
+                    changes.append('{} {:+.1f}%'.format(key, change))
+                    if (key == 'p50_ms' and max_regression is not None
+                            and change > max_regression):
+                        regressions.append(name)
+            print('{:32} {}'.format(name, '  '.join(changes)))
+        if regressions:
+            raise CommandError('p50 ухудшился больше чем на {}%: {}'.format(
+                max_regression, ', '.join(regressions)))
@@ -0,0 +1,183 @@
+import json
+import re
+from urllib.parse import quote
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.test import APIClient
+
+from recipes.models import Ingredient, Recipe, Tag
+from recipes.pantry_index import pantry_index
+from users.models import AuthorStats, User
+
+MIN_ROWS = 5000
+LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+LIST_RE = re.compile(r'\((?:\s*\?\s*,)+\s*\?\s*\)')
+CURSOR_RE = re.compile(r'^DECLARE\s.*?\sFOR\s+(?=SELECT)', re.S)
+
+
+def fingerprint(sql):
+    """SQL без конкретных значений, чтобы сравнивать форму запросов."""
+    return LIST_RE.sub('(...)', LITERAL_RE.sub('?', sql))
+
+
+def seq_scans(plan, min_rows, sizes, parent=None):
+    """Последовательные чтения таблиц, в которых больше min_rows строк.
+
+    Чтение сразу под LIMIT без сортировки останавливается на первых
+    строках и не считается.
+    """
+    found = []
+    if (plan.get('Node Type') == 'Seq Scan'
+            and parent != 'Limit'
+            and sizes.get(plan['Relation Name'], 0) > min_rows):
+        found.append(plan['Relation Name'])
+    for child in plan.get('Plans', ()):
+        found.extend(seq_scans(child, min_rows, sizes, plan['Node Type']))
+    return found
+
+
+class Command(BaseCommand):
+    help = ('Проверка планов запросов горячих эндпоинтов: без новых '
+            'последовательных чтений больших таблиц и без новых запросов')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--baseline',
+                            help='JSON с допустимыми запросами и '
+                                 'последовательными чтениями по сценариям')
+        parser.add_argument('--write-baseline',
+                            action='store_true',
+                            help='Сохранить текущие запросы как эталон')
+        parser.add_argument('--min-rows', type=int, default=MIN_ROWS,
+                            help='Таблицы меньше этого размера не проверяются')
+
+    def handle(self, *args, **options):
+        if options['write_baseline'] and not options['baseline']:
+            raise CommandError('Укажите файл в --baseline')
+        if not Recipe.objects.exists():
+            raise CommandError('Нет данных, сначала запустите generate_data')
+
+        sizes = self.table_sizes()
+        # Индексы в памяти строятся заранее, а общий кэш ленты
+        # отключается, чтобы набор запросов не зависел от прошлых запусков.
+        pantry_index.search(())
+        with override_settings(RECIPE_FEED_SHARED_CACHE=False):
+            captured = {name: self.capture(user, url)
+                        for name, user, url in self.scenarios()}
+
+        report = {}
+        for name, queries in captured.items():
+            scans = set()
+            for sql in queries:
+                with connection.cursor() as cursor:
+                    cursor.execute('EXPLAIN (FORMAT JSON) ' + sql)
+                    plan = cursor.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                scans.update(
+                    '{} | {}'.format(table, fingerprint(sql))
+                    for table in seq_scans(plan[0]['Plan'],
+                                           options['min_rows'],
+                                           sizes))
+            report[name] = {
+                'queries': sorted({fingerprint(sql) for sql in queries}),
+                'seq_scans': sorted(scans),
+            }
+            print('{}: запросов {}, последовательных чтений {}'.format(
+                name, len(queries), len(scans)))
+
+        if options['write_baseline']:
+            with open(options['baseline'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+            print('Эталон сохранён в {}'.format(options['baseline']))
+            return
+        baseline = {}
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as file:
+                baseline = json.load(file)
+
+        errors = []
+        for name, current in report.items():
+            known = baseline.get(name, {})
+            for scan in set(current['seq_scans']) - set(
+                    known.get('seq_scans', ())):
+                errors.append('{}: Seq Scan по {}'.format(name, scan[:300]))
+            if not options['baseline']:
+                continue
+            for query in set(current['queries']) - set(
+                    known.get('queries', ())):
+                errors.append('{}: новый запрос {}'.format(name, query[:300]))
+        if errors:
+            raise CommandError('\n'.join(errors))
+        print('Планы запросов в порядке')
+
+    @staticmethod
+    def table_sizes():
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT relname, reltuples FROM pg_class "
+                           "WHERE relkind = 'r'")
+            return dict(cursor.fetchall())
+
+    @staticmethod
+    def scenarios():
+        user = User.objects.get(pk=AuthorStats.objects.order_by(
+            '-followers_count').values_list('user_id', flat=True)[:1])
+        reader = User.objects.filter(
+            favorites__isnull=False,
+            shop_list__isnull=False,
+            follower__isnull=False
+        ).first() or user
+        recipe = Recipe.objects.order_by('-favorites_count').first()
+        tags = list(Tag.objects.values_list('slug', flat=True)[:2])
+        ingredients = ','.join(str(pk) for pk in Ingredient.objects.filter(
+            ingredients_recipe__recipe=recipe
+        ).values_list('id', flat=True))
+        tag_query = '&'.join('tags={}'.format(slug) for slug in tags)
+        return (
+            ('recipes.list', None, '/api/recipes/'),
+            ('recipes.list.page', None, '/api/recipes/?page=50'),
+            ('recipes.list.cursor', None, '/api/recipes/?cursor='),
+            ('recipes.list.tags', None, '/api/recipes/?' + tag_query),
+            ('recipes.list.all_tags', None,
+             '/api/recipes/?tags_mode=all&' + tag_query),
+            ('recipes.list.author', None,
+             '/api/recipes/?author={}'.format(user.id)),
+            ('recipes.list.favorited', reader,
+             '/api/recipes/?is_favorited=1'),
+            ('recipes.list.shopping_cart', reader,
+             '/api/recipes/?is_in_shopping_cart=1'),
+            ('recipes.list.search', None,
+             '/api/recipes/?search=' + quote(recipe.name)),
+            ('recipes.list.popular', None, '/api/recipes/?ordering=popular'),
+            ('recipes.list.trending', None,
+             '/api/recipes/?ordering=trending'),
+            ('recipes.retrieve', reader, '/api/recipes/{}/'.format(recipe.id)),
+            ('recipes.similar', None,
+             '/api/recipes/{}/similar/'.format(recipe.id)),
+            ('recipes.recommended', reader, '/api/recipes/recommended/'),
+            ('recipes.pantry', None,
+             '/api/recipes/pantry/?ingredients=' + ingredients),
+            ('recipes.download_shopping_cart', reader,
+             '/api/recipes/download_shopping_cart/'),
+            ('users.list', reader, '/api/users/'),
+            ('users.retrieve', reader, '/api/users/{}/'.format(user.id)),
+            ('users.me', reader, '/api/users/me/'),
+            ('users.subscriptions', reader, '/api/users/subscriptions/'),
+        )
+
+    @staticmethod
+    def capture(user, url):
+        client = APIClient()
+        if user is not None:
+            client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as context:
+            response = client.get(url)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        if response.status_code != 200:
+            raise CommandError('{} ответил {}'.format(url,
+                                                      response.status_code))
+        queries = (CURSOR_RE.sub('', query['sql'].lstrip())
+                   for query in context.captured_queries)
+        return [sql for sql in queries if sql.upper().startswith('SELECT')]
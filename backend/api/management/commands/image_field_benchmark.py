@@ -0,0 +1,55 @@
+import timeit
+
+from django.core.management.base import BaseCommand
+from drf_extra_fields.fields import Base64ImageField
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.serializers import RecipeMinifiedSerializer
+from recipes.images import VARIANT_WIDTHS, content_hash, variant_name
+from recipes.models import Recipe
+
+
+class Base64RecipeMinifiedSerializer(RecipeMinifiedSerializer):
+    image = Base64ImageField()
+
+
+class Command(BaseCommand):
+    help = 'Замер стоимости вывода фото в RecipeMinifiedSerializer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=1000,
+                            help='Количество рецептов в выдаче')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Количество повторов замера')
+
+    def handle(self, *args, **options):
+        count = options['count']
+        recipes = []
+        for pk in range(1, count + 1):
+            name = 'recipes/images/{}.jpg'.format(
+                content_hash(str(pk).encode()))
+            recipes.append(Recipe(
+                id=pk,
+                name='Рецепт {}'.format(pk),
+                image=name,
+                image_variants={str(width): variant_name(name, width)
+                                for width in VARIANT_WIDTHS},
+                cooking_time=10
+            ))
+        factory = APIRequestFactory()
+
+        def serialize(serializer_class):
+            request = Request(factory.get('/api/recipes/'))
+            return serializer_class(recipes,
+                                    many=True,
+                                    context={'request': request}).data
+
+        for label, serializer_class in (
+                ('Base64ImageField', Base64RecipeMinifiedSerializer),
+                ('ImageUrlField', RecipeMinifiedSerializer)):
+            best = min(timeit.repeat(lambda: serialize(serializer_class),
+                                     number=1,
+                                     repeat=options['repeat']))
+            print('{}: {:.1f} мкс на рецепт'.format(label,
+                                                    best / count * 10 ** 6))
@@ -0,0 +1,137 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.request import Request
+from rest_framework.serializers import ModelSerializer, PrimaryKeyRelatedField
+from rest_framework.test import APIRequestFactory
+
+from api.management.commands.api_benchmark import image_payload
+from api.serializers import CreateIngredientSerializer, CreateRecipeSerializer
+from recipes.models import Ingredient, IngredientToRecipe, ShopList, Tag
+from users.models import User
+
+
+class RowIngredientSerializer(CreateIngredientSerializer):
+    id = PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+
+
+class RowRecipeSerializer(CreateRecipeSerializer):
+    """Запись ингредиентов по одной строке, как до пакетной записи."""
+
+    ingredients = RowIngredientSerializer(many=True)
+
+    def validate_ingredients(self, value):
+        return value
+
+    @staticmethod
+    def create_ingredients(ingredients, recipe):
+        for ingredient in ingredients:
+            IngredientToRecipe.objects.get_or_create(
+                recipe=recipe,
+                ingredient=ingredient['id'],
+                amount=ingredient['amount']
+            )
+
+    @transaction.atomic
+    def update(self, instance, validated_data):
+        instance.tags.clear()
+        instance.ingredients.clear()
+        tags_data = validated_data.pop('tags')
+        ingredients = validated_data.pop('ingredients')
+        instance.tags.set(tags_data)
+        self.create_ingredients(ingredients, instance)
+        self.create_tags(tags_data, instance)
+        return ModelSerializer.update(self, instance, validated_data)
+
+
+class Command(BaseCommand):
+    help = ('Замер записи рецепта с ингредиентами: запросы к базе и время '
+            'пакетной записи и записи по одной строке. Все изменения '
+            'откатываются')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ingredients', type=int, default=30,
+                            help='Количество ингредиентов в рецепте')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Количество повторов замера')
+
+    def handle(self, *args, **options):
+        count = options['ingredients']
+        self.user = User.objects.order_by('id').first()
+        self.ingredients = list(Ingredient.objects.order_by('id').values_list(
+            'id', flat=True)[:count * 2])
+        self.tags = list(Tag.objects.order_by('id').values_list(
+            'id', flat=True)[:4])
+        if self.user is None or len(self.ingredients) < count * 2:
+            raise CommandError('Нужны пользователь и {} ингредиентов, '
+                               'запустите generate_data'.format(count * 2))
+        request = Request(APIRequestFactory().post('/api/recipes/'))
+        request.user = self.user
+        self.context = {'request': request}
+        self.image = image_payload()
+
+        # Обновление заменяет треть ингредиентов и меняет количество
+        # у каждого второго из оставшихся.
+        shift = count // 3
+        created = self.payload(self.ingredients[:count], 0)
+        updated = self.payload(self.ingredients[shift:count + shift], 1)
+        for label, method, args in (
+                ('Создание', self.create, (created,)),
+                ('Изменение', self.update, (created, updated))):
+            results = [self.measure(serializer_class, method, args,
+                                    options['repeat'])
+                       for serializer_class in (RowRecipeSerializer,
+                                                CreateRecipeSerializer)]
+            (row_queries, row_time), (queries, best) = results
+            print('{}: по одной строке запросов {}, {:.1f} мс; '
+                  'пакетно запросов {}, {:.1f} мс'.format(label,
+                                                          row_queries,
+                                                          row_time * 1000,
+                                                          queries,
+                                                          best * 1000))
+
+    def payload(self, ingredient_ids, offset):
+        return {
+            'name': 'Замер записи',
+            'text': 'Рецепт для замера',
+            'cooking_time': 10 + offset,
+            'image': self.image,
+            'tags': self.tags[offset:offset + 2],
+            'ingredients': [{'id': pk, 'amount': 10 + offset * (i % 2)}
+                            for i, pk in enumerate(ingredient_ids)],
+        }
+
+    def save(self, serializer_class, data, instance=None):
+        serializer = serializer_class(instance,
+                                      data=data,
+                                      context=self.context)
+        serializer.is_valid(raise_exception=True)
+        return serializer.save(author=self.user)
+
+    def create(self, serializer_class, data):
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            self.save(serializer_class, data)
+            elapsed = time.perf_counter() - started
+        return len(context), elapsed
+
+    def update(self, serializer_class, data, new_data):
+        recipe = self.save(CreateRecipeSerializer, data)
+        ShopList.objects.create(user=self.user, recipe=recipe)
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            self.save(serializer_class, new_data, recipe)
+            elapsed = time.perf_counter() - started
+        return len(context), elapsed
+
+    @staticmethod
+    def measure(serializer_class, method, args, repeat):
+        """Запросы и лучшее время из repeat повторов, без следов в базе."""
+        results = []
+        for _ in range(repeat):
+            with transaction.atomic():
+                results.append(method(serializer_class, *args))
+                transaction.set_rollback(True)
+        return results[0][0], min(elapsed for _, elapsed in results)
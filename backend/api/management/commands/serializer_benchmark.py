@@ -0,0 +1,238 @@
+import json
+import timeit
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Prefetch
+from djoser.serializers import UserSerializer
+from drf_extra_fields.fields import Base64ImageField
+from rest_framework.request import Request
+from rest_framework.serializers import (
+    ModelSerializer,
+    ReadOnlyField,
+    SerializerMethodField
+)
+from rest_framework.test import APIRequestFactory
+
+from api.serializers import (
+    CustomUserSerializer,
+    FollowSerializer,
+    GetRecipeListSerializer,
+    IngredientSerializer,
+    RecipeMinifiedSerializer,
+    TagSerializer
+)
+from recipes.models import Ingredient, IngredientToRecipe, Recipe, Tag
+from users.models import Follow, User
+
+
+class BaselineUserSerializer(UserSerializer):
+    """Сериализаторы Baseline* повторяют исходные определения на полях DRF."""
+
+    is_subscribed = SerializerMethodField(read_only=True)
+
+    class Meta:
+        model = User
+        fields = ('id',
+                  'email',
+                  'username',
+                  'first_name',
+                  'last_name',
+                  'is_subscribed')
+
+    def get_is_subscribed(self, obj):
+        user = self.context.get('request').user
+        return (user.is_authenticated
+                and Follow.objects.filter(user=user, author=obj.id).exists())
+
+
+class BaselineTagSerializer(ModelSerializer):
+    class Meta:
+        model = Tag
+        fields = '__all__'
+
+
+class BaselineIngredientSerializer(ModelSerializer):
+    class Meta:
+        model = Ingredient
+        fields = '__all__'
+
+
+class BaselineRecipeIngredientSerializer(ModelSerializer):
+    id = ReadOnlyField(source='ingredient.id')
+    name = ReadOnlyField(source='ingredient.name')
+    measurement_unit = ReadOnlyField(source='ingredient.measurement_unit')
+
+    class Meta:
+        model = IngredientToRecipe
+        fields = ('id',
+                  'name',
+                  'measurement_unit',
+                  'amount')
+
+
+class BaselineRecipeMinifiedSerializer(ModelSerializer):
+    image = Base64ImageField()
+
+    class Meta:
+        model = Recipe
+        fields = ('id',
+                  'name',
+                  'image',
+                  'cooking_time')
+
+
+class BaselineFollowSerializer(ModelSerializer):
+    id = ReadOnlyField(source='author.id')
+    username = ReadOnlyField(source='author.username')
+    first_name = ReadOnlyField(source='author.first_name')
+    last_name = ReadOnlyField(source='author.last_name')
+    recipes = SerializerMethodField()
+    recipes_count = SerializerMethodField()
+    is_subscribed = SerializerMethodField()
+
+    class Meta:
+        model = Follow
+        fields = ('id',
+                  'username',
+                  'first_name',
+                  'last_name',
+                  'is_subscribed',
+                  'recipes',
+                  'recipes_count')
+
+    def get_recipes(self, obj):
+        request = self.context.get('request')
+        recipes_limit = request.query_params.get('recipes_limit')
+        queryset = obj.author.recipes.all()
+        if recipes_limit:
+            queryset = queryset[:int(recipes_limit)]
+        return BaselineRecipeMinifiedSerializer(queryset, many=True).data
+
+    def get_recipes_count(self, obj):
+        return Recipe.objects.filter(author=obj.author).count()
+
+    def get_is_subscribed(self, obj):
+        # В исходной версии здесь стоял author=obj.id, то есть id подписки.
+        user = self.context.get('request').user
+        return (user.is_authenticated
+                and Follow.objects.filter(user=user,
+                                          author=obj.author_id).exists())
+
+
+class BaselineRecipeSerializer(ModelSerializer):
+    author = BaselineUserSerializer(read_only=True)
+    tags = BaselineTagSerializer(read_only=True, many=True)
+    image = Base64ImageField()
+    is_favorited = SerializerMethodField()
+    is_in_shopping_cart = SerializerMethodField()
+    ingredients = BaselineRecipeIngredientSerializer(
+        many=True,
+        source='ingredients_recipe'
+    )
+
+    class Meta:
+        model = Recipe
+        fields = ('id',
+                  'author',
+                  'tags',
+                  'ingredients',
+                  'name',
+                  'image',
+                  'text',
+                  'cooking_time',
+                  'is_favorited',
+                  'is_in_shopping_cart')
+
+    def get_is_in_shopping_cart(self, obj):
+        user = self.context.get('request').user
+        return (user.is_authenticated
+                and obj.shop_list.filter(user=user).exists())
+
+    def get_is_favorited(self, obj):
+        user = self.context.get('request').user
+        return (user.is_authenticated
+                and obj.favorites.filter(user=user).exists())
+
+
+def comparable(data):
+    """Ответ для сравнения с исходным.
+
+    Ключа image_variants в исходных ответах нет, а порядок тегов
+    и ингредиентов рецепта в них не был задан.
+    """
+    if isinstance(data, list):
+        return [comparable(value) for value in data]
+    if not isinstance(data, dict):
+        return data
+    result = {}
+    for key, value in data.items():
+        if key == 'image_variants':
+            continue
+        value = comparable(value)
+        if key in ('tags', 'ingredients'):
+            value = sorted(value, key=lambda item: item['id'])
+        result[key] = value
+    return result
+
+
+class Command(BaseCommand):
+    help = ('Сравнение прямой сборки ответа с исходными сериализаторами '
+            'на полях DRF: одинаковый результат и время на объект, у исходных '
+            'вместе с их запросами к базе')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=100,
+                            help='Количество объектов в выдаче')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Количество повторов замера')
+
+    def handle(self, *args, **options):
+        count = options['count']
+        user = User.objects.filter(follower__isnull=False).first()
+        if user is None or not Recipe.objects.exists():
+            raise CommandError('Нет данных, сначала запустите generate_data')
+        # Исходная выдача подписок берёт ограничение из запроса.
+        request = Request(APIRequestFactory().get('/api/recipes/',
+                                                  {'recipes_limit': 3}))
+        request.user = user
+
+        cases = (
+            ('Рецепты', GetRecipeListSerializer, BaselineRecipeSerializer,
+             Recipe.objects.with_user_flags(user).with_related(user)),
+            ('Подписки', FollowSerializer, BaselineFollowSerializer,
+             Follow.objects.filter(user=user).select_related(
+                 'author__stats').prefetch_related(
+                 Prefetch('author__recipes',
+                          queryset=Recipe.objects.latest_per_author(3),
+                          to_attr='latest_recipes'))),
+            ('Рецепты кратко', RecipeMinifiedSerializer,
+             BaselineRecipeMinifiedSerializer, Recipe.objects.all()),
+            ('Пользователи', CustomUserSerializer, BaselineUserSerializer,
+             User.objects.all()),
+            ('Теги', TagSerializer, BaselineTagSerializer, Tag.objects.all()),
+            ('Ингредиенты', IngredientSerializer,
+             BaselineIngredientSerializer, Ingredient.objects.all()),
+        )
+        for label, serializer_class, baseline_class, queryset in cases:
+            objects = list(queryset[:count])
+            if not objects:
+                continue
+
+            def serialize(serializer_class):
+                return serializer_class(objects,
+                                        many=True,
+                                        context={'request': request}).data
+
+            if (json.dumps(comparable(serialize(serializer_class)))
+                    != json.dumps(comparable(serialize(baseline_class)))):
+                raise CommandError('{}: ответы различаются'.format(label))
+            times = [
+                min(timeit.repeat(lambda: serialize(serializer), number=1,
+                                  repeat=options['repeat'])) / len(objects)
+                for serializer in (baseline_class, serializer_class)
+            ]
+            print('{}: исходный {:.1f} мкс, напрямую {:.1f} мкс на объект, '
+                  'быстрее в {:.1f} раза'.format(label,
+                                                 times[0] * 10 ** 6,
+                                                 times[1] * 10 ** 6,
+                                                 times[0] / times[1]))
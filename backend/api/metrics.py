@@ -0,0 +1,185 @@
+import bisect
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+UNRESOLVED = 'unresolved'
+
+logger = logging.getLogger(__name__)
+_local = threading.local()
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class RequestStats:
+    """Запросы к базе и время обработки одного HTTP-запроса."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0
+        self.serializer_time = 0
+        self.serializer_depth = 0
+
+    @property
+    def total_time(self):
+        return time.perf_counter() - self.started
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+
+    def server_timing(self):
+        return ('db;dur={:.1f};desc="{} queries", '
+                'serializer;dur={:.1f}, '
+                'total;dur={:.1f}').format(self.db_time * 1000,
+                                           self.queries,
+                                           self.serializer_time * 1000,
+                                           self.total_time * 1000)
+
+
+def current():
+    return getattr(_local, 'stats', None)
+
+
+@contextmanager
+def collect(stats):
+    """Собирает в stats запросы к базе и время для кода внутри блока."""
+    previous = current()
+    _local.stats = stats
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(stats))
+            yield stats
+    finally:
+        _local.stats = previous
+
+
+@contextmanager
+def serializer_timer():
+    """Время сериализации; вложенные сериализаторы не считаются дважды."""
+    stats = current()
+    if stats is None:
+        yield
+        return
+    stats.serializer_depth += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.serializer_depth -= 1
+        if not stats.serializer_depth:
+            stats.serializer_time += time.perf_counter() - started
+
+
+class Registry:
+    """Метрики по маршрутам в памяти процесса."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = defaultdict(int)
+        self._counters = defaultdict(float)
+        self._buckets = defaultdict(lambda: [0] * len(DURATION_BUCKETS))
+
+    def observe(self, route, method, status, stats):
+        duration = stats.total_time
+        with self._lock:
+            self._requests[route, method, status] += 1
+            self._counters['db_queries', route] += stats.queries
+            self._counters['db_seconds', route] += stats.db_time
+            self._counters['serializer_seconds', route] += (
+                stats.serializer_time)
+            self._counters['request_seconds', route] += duration
+            self._counters['requests', route] += 1
+            position = bisect.bisect_left(DURATION_BUCKETS, duration)
+            if position < len(DURATION_BUCKETS):
+                self._buckets[route][position] += 1
+
+    def budget_exceeded(self, route):
+        with self._lock:
+            self._counters['budget_exceeded', route] += 1
+
+    def render(self):
+        """Метрики в текстовом формате Prometheus."""
+        with self._lock:
+            requests = dict(self._requests)
+            counters = dict(self._counters)
+            buckets = {route: list(counts)
+                       for route, counts in self._buckets.items()}
+        lines = [
+            '# HELP foodgram_requests_total Обработанные запросы.',
+            '# TYPE foodgram_requests_total counter',
+        ]
+        for (route, method, status), count in sorted(requests.items()):
+            lines.append(
+                'foodgram_requests_total{{route="{}",method="{}",'
+                'status="{}"}} {}'.format(route, method, status, count))
+        for name, kind, description in (
+                ('db_queries', 'counter', 'Запросы к базе данных.'),
+                ('db_seconds', 'counter', 'Время запросов к базе.'),
+                ('serializer_seconds', 'counter', 'Время сериализации.'),
+                ('budget_exceeded', 'counter',
+                 'Превышения бюджета запросов к базе.')):
+            lines += ['# HELP foodgram_{}_total {}'.format(name, description),
+                      '# TYPE foodgram_{}_total {}'.format(name, kind)]
+            for (counter, route), value in sorted(counters.items()):
+                if counter == name:
+                    lines.append('foodgram_{}_total{{route="{}"}} {}'.format(
+                        name, route, format_value(value)))
+        lines += [
+            '# HELP foodgram_request_duration_seconds Время ответа.',
+            '# TYPE foodgram_request_duration_seconds histogram',
+        ]
+        for route, counts in sorted(buckets.items()):
+            total = 0
+            for bound, count in zip(DURATION_BUCKETS, counts):
+                total += count
+                lines.append(
+                    'foodgram_request_duration_seconds_bucket{{route="{}",'
+                    'le="{}"}} {}'.format(route, bound, total))
+            lines += [
+                'foodgram_request_duration_seconds_bucket{{route="{}",'
+                'le="+Inf"}} {}'.format(
+                    route, int(counters['requests', route])),
+                'foodgram_request_duration_seconds_sum{{route="{}"}} '
+                '{}'.format(route,
+                            format_value(counters['request_seconds', route])),
+                'foodgram_request_duration_seconds_count{{route="{}"}} '
+                '{}'.format(route, int(counters['requests', route])),
+            ]
+        return '\n'.join(lines) + '\n'
+
+
+def format_value(value):
+    return '{:.6f}'.format(value).rstrip('0').rstrip('.')
+
+
+def check_budget(route, method, stats):
+    """Бюджет ищется сначала для «МЕТОД маршрут», затем для маршрута."""
+    budgets = settings.QUERY_BUDGETS
+    budget = budgets.get('{} {}'.format(method, route),
+                         budgets.get(route, settings.QUERY_BUDGET_DEFAULT))
+    if budget is None or stats.queries <= budget:
+        return
+    registry.budget_exceeded(route)
+    message = '{} {}: {} запросов к базе при бюджете {}'.format(
+        method, route, stats.queries, budget)
+    if settings.QUERY_BUDGET_RAISE:
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+
+registry = Registry()
@@ -0,0 +1,45 @@
+from django.conf import settings
+
+from api import metrics
+
+
+class QueryMetricsMiddleware:
+    """Считает запросы к базе, время базы, сериализации и ответа.
+
+    Метрики группируются по имени маршрута, например recipes-list, и
+    отдаются в формате Prometheus. С SERVER_TIMING те же числа уходят
+    в заголовок Server-Timing. Потоковые ответы учитываются целиком,
+    когда тело отдано клиенту.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = metrics.RequestStats()
+        with metrics.collect(stats):
+            response = self.get_response(request)
+        if settings.SERVER_TIMING:
+            response['Server-Timing'] = stats.server_timing()
+        if response.streaming:
+            response.streaming_content = self.stream(
+                request, response, response.streaming_content, stats)
+        else:
+            self.finish(request, response, stats)
+        return response
+
+    def stream(self, request, response, content, stats):
+        with metrics.collect(stats):
+            yield from content
+        self.finish(request, response, stats)
+
+    @staticmethod
+    def finish(request, response, stats):
+        match = request.resolver_match
+        route = match.url_name if match and match.url_name else (
+            metrics.UNRESOLVED)
+        metrics.registry.observe(route,
+                                 request.method,
+                                 response.status_code,
+                                 stats)
+        metrics.check_budget(route, request.method, stats)
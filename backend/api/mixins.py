@@ -1,6 +1,76 @@
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from rest_framework.mixins import ListModelMixin, RetrieveModelMixin
+from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet
 
+from api import metrics
+from recipes import catalogue
+
 
 class CustomUserMixin(ListModelMixin, RetrieveModelMixin, GenericViewSet):
     pass
+
+
+class TimedSerializerMixin:
+    """Учитывает время сериализации в метриках текущего запроса.
+
+    Сериализаторы горячих выдач переопределяют represent и собирают
+    словарь ответа сами, минуя поля DRF.
+    """
+
+    def to_representation(self, instance):
+        with metrics.serializer_timer():
+            return self.represent(instance)
+
+    def represent(self, instance):
+        return super().to_representation(instance)
+
+
+class CatalogueCacheMixin(CustomUserMixin):
+    """Справочник с кэшем готовых ответов и проверкой ETag.
+
+    Ответы хранятся по версии каталога, которую сигналы и команды
+    загрузки данных меняют в базе, поэтому её видят все процессы.
+    Повторный запрос с If-None-Match или If-Modified-Since получает 304
+    после одного запроса версии, без выборки и сериализации каталога.
+    """
+
+    catalogue_name = None
+
+    def list(self, request, *args, **kwargs):
+        return self.cached(request, 'list', super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached(request,
+                           'detail:{}'.format(kwargs[self.lookup_field]),
+                           super().retrieve,
+                           *args,
+                           **kwargs)
+
+    def cached(self, request, key, handler, *args, **kwargs):
+        if request.query_params or request.accepted_renderer.format != 'json':
+            return handler(request, *args, **kwargs)
+        version = catalogue.get_version(self.catalogue_name)
+        headers = {
+            'ETag': '"{}-{}"'.format(version, key),
+            'Last-Modified': http_date(version // 10 ** 9)
+        }
+        not_modified = get_conditional_response(
+            request,
+            etag=headers['ETag'],
+            last_modified=version // 10 ** 9
+        )
+        if not_modified is not None:
+            for header, value in headers.items():
+                not_modified[header] = value
+            return not_modified
+
+        data = catalogue.get_payload(self.catalogue_name, version, key)
+        if data is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            data = response.data
+            catalogue.set_payload(self.catalogue_name, version, key, data)
+        return Response(data, headers=headers)
@@ -1,6 +1,72 @@
-from rest_framework.pagination import PageNumberPagination
+from collections import OrderedDict
+from hashlib import md5
+
+from django.core.cache import cache
+from django.db.models import QuerySet
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.response import Response
+
+
+class CachedCountCursorPagination(CursorPagination):
+    """Курсорная пагинация с закэшированным количеством объектов."""
+
+    page_size = 6
+    page_size_query_param = 'limit'
+    ordering = '-id'
+    count_timeout = 60
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = self.get_count(queryset)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_count(self, queryset):
+        key = 'count:{}'.format(md5(str(queryset.query).encode()).hexdigest())
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, self.count_timeout)
+        return count
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+
+class RecipeCursorPagination(CachedCountCursorPagination):
+    ordering = ('-pub_date', '-id')
 
 
 class CustomPaginator(PageNumberPagination):
+    """Постраничная пагинация, переключаемая на курсорную параметром cursor.
+
+    Курсорная выдача используется только для запросов без собственной
+    сортировки, например без поиска по рецептам, и не для готовых списков.
+    """
+
     page_size = 6
     page_size_query_param = 'limit'
+    cursor_pagination_class = CachedCountCursorPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_paginator = None
+        if ('cursor' in request.query_params
+                and isinstance(queryset, QuerySet)
+                and not queryset.query.order_by):
+            self.cursor_paginator = self.cursor_pagination_class()
+            return self.cursor_paginator.paginate_queryset(queryset,
+                                                           request,
+                                                           view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class RecipePaginator(CustomPaginator):
+    cursor_pagination_class = RecipeCursorPagination
@@ -0,0 +1,41 @@
+from django.utils.functional import cached_property
+
+from recipes.models import Favorite, ShopList
+from users.models import Follow
+
+
+class UserRelations:
+    """Подписки, избранное и покупки текущего пользователя.
+
+    Каждое множество id загружается одним запросом при первом обращении
+    и живёт до конца запроса.
+    """
+
+    def __init__(self, user):
+        self.user = user
+
+    def _ids(self, model, field):
+        if not self.user.is_authenticated:
+            return frozenset()
+        return frozenset(model.objects.filter(
+            user=self.user
+        ).values_list(field, flat=True))
+
+    @cached_property
+    def following(self):
+        return self._ids(Follow, 'author_id')
+
+    @cached_property
+    def favorites(self):
+        return self._ids(Favorite, 'recipe_id')
+
+    @cached_property
+    def shop_list(self):
+        return self._ids(ShopList, 'recipe_id')
+
+
+def get_relations(request):
+    relations = getattr(request, 'user_relations', None)
+    if relations is None:
+        relations = request.user_relations = UserRelations(request.user)
+    return relations
@@ -1,25 +1,83 @@
 from django.db import transaction
+from django.db.models import prefetch_related_objects
 from djoser.serializers import UserCreateSerializer, UserSerializer
-from drf_extra_fields.fields import Base64ImageField
 from rest_framework.serializers import (
+    IntegerField,
     ModelSerializer,
     PrimaryKeyRelatedField,
     ReadOnlyField,
-    SerializerMethodField
+    SerializerMethodField,
+    ValidationError
 )
 
-from api.validators import validate_following
+from api import shopping_list
+from api.fields import (
+    HashedBase64ImageField,
+    ImageUrlField,
+    ImageVariantsField,
+    image_url,
+    image_variant_urls,
+    media_url
+)
+from api.mixins import TimedSerializerMixin
+from api.relations import get_relations
+from api.validators import validate_following, validate_recipes_limit
 from recipes.models import (
     Favorite,
     Ingredient,
     IngredientToRecipe,
     Recipe,
     ShopList,
-    Tag
+    ShoppingCartItem,
+    Tag,
+    recipe_prefetches
 )
 from users.models import Follow, User
 
 
+def represent_user(user, request):
+    if hasattr(user, 'is_subscribed'):
+        is_subscribed = user.is_subscribed
+    else:
+        is_subscribed = user.id in get_relations(request).following
+    return {'id': user.id,
+            'email': user.email,
+            'username': user.username,
+            'first_name': user.first_name,
+            'last_name': user.last_name,
+            'is_subscribed': is_subscribed}
+
+
+def represent_tag(tag):
+    return {'id': tag.id,
+            'name': tag.name,
+            'color': tag.color,
+            'slug': tag.slug}
+
+
+def prefetched(instance, attr, name):
+    """Список из Prefetch(to_attr=attr) или, без него, запрос по связи."""
+    if hasattr(instance, attr):
+        return getattr(instance, attr)
+    return getattr(instance, name).all()
+
+
+def represent_recipe_minified(recipe, base_url):
+    return {'id': recipe.id,
+            'name': recipe.name,
+            'image': image_url(recipe.image, base_url),
+            'image_variants': image_variant_urls(recipe, base_url),
+            'cooking_time': recipe.cooking_time}
+
+
+def represent_recipe_ingredient(row):
+    ingredient = row.ingredient
+    return {'id': ingredient.id,
+            'name': ingredient.name,
+            'measurement_unit': ingredient.measurement_unit,
+            'amount': row.amount}
+
+
 class CustomUserCreateSerializer(UserCreateSerializer):
     class Meta:
         model = User
@@ -31,7 +89,7 @@ class CustomUserCreateSerializer(UserCreateSerializer):
                   'password')
 
 
-class CustomUserSerializer(UserSerializer):
+class CustomUserSerializer(TimedSerializerMixin, UserSerializer):
     is_subscribed = SerializerMethodField(read_only=True)
 
     class Meta:
@@ -46,24 +104,36 @@ class CustomUserSerializer(UserSerializer):
     lookup_field = 'username'
 
     def get_is_subscribed(self, obj):
-        user = self.context.get('request').user
-        return (user.is_authenticated
-                and Follow.objects.filter(user=user, author=obj.id).exists())
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        relations = get_relations(self.context.get('request'))
+        return obj.id in relations.following
+
+    def represent(self, instance):
+        return represent_user(instance, self.context.get('request'))
 
 
-class TagSerializer(ModelSerializer):
+class TagSerializer(TimedSerializerMixin, ModelSerializer):
     class Meta:
         model = Tag
         fields = '__all__'
 
+    def represent(self, instance):
+        return represent_tag(instance)
+
 
-class IngredientSerializer(ModelSerializer):
+class IngredientSerializer(TimedSerializerMixin, ModelSerializer):
     """Получение ингредиентов."""
 
     class Meta:
         model = Ingredient
         fields = '__all__'
 
+    def represent(self, instance):
+        return {'id': instance.id,
+                'name': instance.name,
+                'measurement_unit': instance.measurement_unit}
+
 
 class IngredientToRecipeSerializer(ModelSerializer):
     id = ReadOnlyField(source='ingredient.id')
@@ -77,9 +147,12 @@ class IngredientToRecipeSerializer(ModelSerializer):
                   'measurement_unit',
                   'amount')
 
+    def to_representation(self, instance):
+        return represent_recipe_ingredient(instance)
+
 
 class CreateIngredientSerializer(ModelSerializer):
-    id = PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    id = IntegerField()
 
     class Meta:
         model = IngredientToRecipe
@@ -87,18 +160,24 @@ class CreateIngredientSerializer(ModelSerializer):
                   'amount')
 
 
-class RecipeMinifiedSerializer(ModelSerializer):
-    image = Base64ImageField()
+class RecipeMinifiedSerializer(TimedSerializerMixin, ModelSerializer):
+    image = ImageUrlField()
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Recipe
         fields = ('id',
                   'name',
                   'image',
+                  'image_variants',
                   'cooking_time')
 
+    def represent(self, instance):
+        return represent_recipe_minified(
+            instance, media_url(self.context.get('request')))
+
 
-class FollowSerializer(ModelSerializer):
+class FollowSerializer(TimedSerializerMixin, ModelSerializer):
     id = ReadOnlyField(source='author.id')
     username = ReadOnlyField(source='author.username')
     first_name = ReadOnlyField(source='author.first_name')
@@ -122,28 +201,41 @@ class FollowSerializer(ModelSerializer):
         return data
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        recipes_limit = request.query_params.get('recipes_limit')
-        queryset = None
-        if recipes_limit:
-            queryset = obj.author.recipes.all()[:int(recipes_limit)]
+        if hasattr(obj.author, 'latest_recipes'):
+            recipes = obj.author.latest_recipes
         else:
-            queryset = obj.author.recipes.all()
-        return RecipeMinifiedSerializer(queryset, many=True).data
+            request = self.context.get('request')
+            recipes_limit = validate_recipes_limit(
+                request.query_params.get('recipes_limit'))
+            recipes = obj.author.recipes.all()
+            if recipes_limit is not None:
+                recipes = recipes[:recipes_limit]
+        base_url = media_url(None)
+        return [represent_recipe_minified(recipe, base_url)
+                for recipe in recipes]
 
     def get_recipes_count(self, obj):
-        return Recipe.objects.filter(author=obj.author).count()
+        return obj.author.stats.recipes_count
 
     def get_is_subscribed(self, obj):
-        user = self.context.get('request').user
-        return (user.is_authenticated
-                and Follow.objects.filter(user=user, author=obj.id).exists())
+        return True
+
+    def represent(self, instance):
+        author = instance.author
+        return {'id': author.id,
+                'username': author.username,
+                'first_name': author.first_name,
+                'last_name': author.last_name,
+                'is_subscribed': self.get_is_subscribed(instance),
+                'recipes': self.get_recipes(instance),
+                'recipes_count': self.get_recipes_count(instance)}
 
 
-class GetRecipeListSerializer(ModelSerializer):
+class GetRecipeListSerializer(TimedSerializerMixin, ModelSerializer):
     author = CustomUserSerializer(read_only=True)
     tags = TagSerializer(read_only=True, many=True)
-    image = Base64ImageField()
+    image = ImageUrlField()
+    image_variants = ImageVariantsField()
     is_favorited = SerializerMethodField()
     is_in_shopping_cart = SerializerMethodField()
     ingredients = IngredientToRecipeSerializer(many=True,
@@ -157,6 +249,7 @@ class GetRecipeListSerializer(ModelSerializer):
                   'ingredients',
                   'name',
                   'image',
+                  'image_variants',
                   'text',
                   'cooking_time',
                   'is_favorited',
@@ -171,20 +264,43 @@ class GetRecipeListSerializer(ModelSerializer):
         return IngredientToRecipeSerializer(ingredients, many=True).data
 
     def get_is_in_shopping_cart(self, obj):
-        user = self.context.get('request').user
-        return (user.is_authenticated
-                and obj.shop_list.filter(user=user).exists())
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
+        relations = get_relations(self.context.get('request'))
+        return obj.id in relations.shop_list
 
     def get_is_favorited(self, obj):
-        user = self.context.get('request').user
-        return (user.is_authenticated
-                and obj.favorites.filter(user=user).exists())
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
+        relations = get_relations(self.context.get('request'))
+        return obj.id in relations.favorites
+
+    def represent(self, instance):
+        request = self.context.get('request')
+        base_url = media_url(request)
+        return {
+            'id': instance.id,
+            'author': represent_user(instance.author, request),
+            'tags': [represent_tag(tag) for tag in prefetched(
+                instance, 'prefetched_tags', 'tags')],
+            'ingredients': [represent_recipe_ingredient(row)
+                            for row in prefetched(instance,
+                                                  'prefetched_ingredients',
+                                                  'ingredients_recipe')],
+            'name': instance.name,
+            'image': image_url(instance.image, base_url),
+            'image_variants': image_variant_urls(instance, base_url),
+            'text': instance.text,
+            'cooking_time': instance.cooking_time,
+            'is_favorited': self.get_is_favorited(instance),
+            'is_in_shopping_cart': self.get_is_in_shopping_cart(instance),
+        }
 
 
 class CreateRecipeSerializer(ModelSerializer):
     tags = PrimaryKeyRelatedField(many=True, queryset=Tag.objects.all())
     ingredients = CreateIngredientSerializer(many=True)
-    image = Base64ImageField()
+    image = HashedBase64ImageField()
 
     class Meta:
         model = Recipe
@@ -196,18 +312,63 @@ class CreateRecipeSerializer(ModelSerializer):
                   'image',
                   'cooking_time')
 
+    def validate_ingredients(self, value):
+        ids = [ingredient['id'] for ingredient in value]
+        if len(ids) != len(set(ids)):
+            raise ValidationError('Ингредиенты не должны повторяться!')
+        ingredients = Ingredient.objects.in_bulk(ids)
+        missing = [pk for pk in ids if pk not in ingredients]
+        if missing:
+            raise ValidationError('Ингредиенты не найдены: {}'.format(
+                ', '.join(map(str, missing))))
+        for ingredient in value:
+            ingredient['id'] = ingredients[ingredient['id']]
+        return value
+
     @staticmethod
     def create_tags(tags, recipe):
         recipe.tags.add(*tags)
 
     @staticmethod
     def create_ingredients(ingredients, recipe):
-        for ingredient in ingredients:
-            IngredientToRecipe.objects.get_or_create(
+        IngredientToRecipe.objects.bulk_create([
+            IngredientToRecipe(recipe=recipe,
+                               ingredient=ingredient['id'],
+                               amount=ingredient['amount'])
+            for ingredient in ingredients
+        ])
+
+    @staticmethod
+    def update_ingredients(ingredients, recipe):
+        """Записывает только изменившиеся строки и возвращает разницу."""
+        rows = {row.ingredient_id: row
+                for row in recipe.ingredients_recipe.all()}
+        old_amounts = {ingredient_id: row.amount
+                       for ingredient_id, row in rows.items()}
+        amounts = {ingredient['id'].id: ingredient['amount']
+                   for ingredient in ingredients}
+        changed = []
+        for ingredient_id in rows.keys() & amounts.keys():
+            if rows[ingredient_id].amount != amounts[ingredient_id]:
+                rows[ingredient_id].amount = amounts[ingredient_id]
+                changed.append(rows[ingredient_id])
+        removed = rows.keys() - amounts.keys()
+        if removed:
+            IngredientToRecipe.objects.filter(
                 recipe=recipe,
-                ingredient=ingredient['id'],
-                amount=ingredient['amount']
-            )
+                ingredient_id__in=removed
+            ).delete()
+        IngredientToRecipe.objects.bulk_update(changed, ['amount'])
+        IngredientToRecipe.objects.bulk_create([
+            IngredientToRecipe(recipe=recipe,
+                               ingredient=ingredient['id'],
+                               amount=ingredient['amount'])
+            for ingredient in ingredients
+            if ingredient['id'].id not in rows
+        ])
+        return {ingredient_id: (amounts.get(ingredient_id, 0)
+                                - old_amounts.get(ingredient_id, 0))
+                for ingredient_id in old_amounts.keys() | amounts.keys()}
 
     @transaction.atomic
     def create(self, validated_data):
@@ -220,19 +381,24 @@ class CreateRecipeSerializer(ModelSerializer):
 
     @transaction.atomic
     def update(self, instance, validated_data):
-        instance.tags.clear()
-        instance.ingredients.clear()
         tags_data = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
         instance.tags.set(tags_data)
-        self.create_ingredients(ingredients, instance)
-        self.create_tags(tags_data, instance)
+        with shopping_list.batch(instance.id):
+            amounts = self.update_ingredients(ingredients, instance)
+            user_ids = list(instance.shop_list.values_list('user_id',
+                                                           flat=True))
+            ShoppingCartItem.objects.apply_amounts(user_ids, amounts)
+            shopping_list.invalidate(*user_ids)
         return super().update(instance, validated_data)
 
     def to_representation(self, instance):
+        request = self.context.get('request')
+        prefetch_related_objects([instance],
+                                 *recipe_prefetches(request.user))
         return GetRecipeListSerializer(
             instance,
-            context={'request': self.context.get('request')}
+            context={'request': request}
         ).data
 
 
@@ -0,0 +1,110 @@
+import csv
+import threading
+import uuid
+from contextlib import contextmanager
+
+from django.core.cache import cache
+
+from recipes import units
+from recipes.models import ShoppingCartItem
+
+CACHE_KEY = 'shopping_list:{}'
+VERSION_KEY = 'shopping_list_version:{}'
+CACHE_TIMEOUT = 60 * 60
+CHUNK_SIZE = 500
+
+_local = threading.local()
+
+
+class Echo:
+    """Буфер для csv.writer, возвращающий записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+def get_version(user_id):
+    key = VERSION_KEY.format(user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def get_rows(user):
+    """Строки списка покупок: (название, единица измерения, количество).
+
+    Один ингредиент в совместимых единицах складывается в базе и
+    выводится в удобной единице. Агрегат берётся из кэша, при промахе
+    читается курсором и сохраняется в кэш после того, как будет отдан
+    целиком. Строки хранятся вместе с версией списка на начало чтения:
+    если список изменился, пока строки отдавались, они не подойдут.
+    """
+    key = CACHE_KEY.format(user.id)
+    version = get_version(user.id)
+    cached_version, rows = cache.get(key, (None, None))
+    if rows is not None and cached_version == version:
+        yield from rows
+        return
+
+    rows = []
+    groups = ShoppingCartItem.objects.filter(user=user).grouped()
+    for name, base_unit, unit_count, unit, amount, base_amount in (
+            groups.iterator(chunk_size=CHUNK_SIZE)):
+        if unit_count > 1 or unit == base_unit:
+            unit, amount = units.humanize(base_unit, base_amount)
+        row = (name, unit, amount)
+        rows.append(row)
+        yield row
+    cache.set(key, (version, rows), CACHE_TIMEOUT)
+
+
+def invalidate(*user_ids):
+    cache.set_many({VERSION_KEY.format(user_id): uuid.uuid4().hex
+                    for user_id in user_ids}, None)
+
+
+def batched_recipes():
+    if not hasattr(_local, 'recipe_ids'):
+        _local.recipe_ids = set()
+    return _local.recipe_ids
+
+
+@contextmanager
+def batch(recipe_id):
+    """Агрегат списков покупок для рецепта обновляет вызывающий код.
+
+    Сигналы строк ингредиентов и покупок рецепта внутри блока его не
+    трогают, чтобы массовое изменение применялось одной разницей.
+    """
+    recipe_ids = batched_recipes()
+    nested = recipe_id in recipe_ids
+    recipe_ids.add(recipe_id)
+    try:
+        yield
+    finally:
+        if not nested:
+            recipe_ids.discard(recipe_id)
+
+
+def is_batched(recipe_id):
+    return recipe_id in batched_recipes()
+
+
+def render_txt(rows):
+    for name, unit, amount in rows:
+        yield '{} {} - {}\n'.format(name, unit, amount)
+
+
+def render_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('Название', 'Единица измерения', 'Количество'))
+    for row in rows:
+        yield writer.writerow(row)
+
+
+FORMATS = {
+    'txt': ('text/plain; charset=UTF-8', render_txt),
+    'csv': ('text/csv; charset=UTF-8', render_csv),
+}
@@ -0,0 +1,175 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save
+)
+from django.dispatch import receiver
+
+from api import shopping_list
+from recipes import catalogue, images
+from recipes.models import (
+    Favorite,
+    Ingredient,
+    IngredientToRecipe,
+    Recipe,
+    ShopList,
+    ShoppingCartItem,
+    Tag
+)
+from users.models import AuthorStats, Follow, User
+
+# Поля автора, которые выводятся в ленте рецептов
+FEED_USER_FIELDS = frozenset(('email', 'username', 'first_name', 'last_name'))
+
+COUNTERS = {
+    Favorite: (Recipe, 'recipe_id', 'favorites_count'),
+    ShopList: (Recipe, 'recipe_id', 'shop_list_count'),
+    Recipe: (AuthorStats, 'author_id', 'recipes_count'),
+    Follow: (AuthorStats, 'author_id', 'followers_count'),
+}
+
+
+def update_counter(instance, delta):
+    model, key, field = COUNTERS[type(instance)]
+    model.objects.filter(pk=getattr(instance, key)).update(
+        **{field: F(field) + delta})
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShopList)
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Follow)
+def counted_created(sender, instance, created, **kwargs):
+    if created:
+        update_counter(instance, 1)
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShopList)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Follow)
+def counted_deleted(sender, instance, **kwargs):
+    update_counter(instance, -1)
+
+
+def invalidate_recipe_on_commit(recipe_id):
+    transaction.on_commit(lambda: catalogue.invalidate_recipes(
+        Recipe.objects.filter(id=recipe_id)))
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def tag_changed(sender, **kwargs):
+    catalogue.bump(catalogue.TAGS, catalogue.FEED)
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def ingredient_changed(sender, **kwargs):
+    catalogue.bump(catalogue.INGREDIENTS, catalogue.FEED)
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_saved(sender, instance, created, **kwargs):
+    if created:
+        return
+    shopping_list.invalidate(*ShoppingCartItem.objects.filter(
+        ingredient=instance).values_list('user_id', flat=True))
+
+
+def apply_recipe_amounts(recipe_id, amounts):
+    """Переносит изменение ингредиентов рецепта в списки покупок."""
+    if shopping_list.is_batched(recipe_id):
+        return
+    user_ids = list(ShopList.objects.filter(
+        recipe_id=recipe_id
+    ).values_list('user_id', flat=True))
+    ShoppingCartItem.objects.apply_amounts(user_ids, amounts)
+    shopping_list.invalidate(*user_ids)
+
+
+@receiver(post_save, sender=ShopList)
+def shop_list_saved(sender, instance, created, **kwargs):
+    if created and not shopping_list.is_batched(instance.recipe_id):
+        ShoppingCartItem.objects.add_recipe([instance.user_id],
+                                            instance.recipe_id)
+    shopping_list.invalidate(instance.user_id)
+
+
+@receiver(post_delete, sender=ShopList)
+def shop_list_deleted(sender, instance, **kwargs):
+    if not shopping_list.is_batched(instance.recipe_id):
+        ShoppingCartItem.objects.remove_recipe([instance.user_id],
+                                               instance.recipe_id)
+    shopping_list.invalidate(instance.user_id)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, **kwargs):
+    images.schedule(instance)
+    invalidate_recipe_on_commit(instance.id)
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    author_ids = [instance.author_id]
+    tag_slugs = list(instance.tags.values_list('slug', flat=True))
+    transaction.on_commit(
+        lambda: catalogue.invalidate_feed(author_ids, tag_slugs))
+
+
+@receiver(pre_save, sender=IngredientToRecipe)
+def recipe_ingredient_saving(sender, instance, raw, **kwargs):
+    if instance.pk is None or raw:
+        return
+    old = IngredientToRecipe.objects.filter(pk=instance.pk).values_list(
+        'recipe_id', 'ingredient_id', 'amount').first()
+    if old is not None:
+        recipe_id, ingredient_id, amount = old
+        apply_recipe_amounts(recipe_id, {ingredient_id: -amount})
+
+
+@receiver(post_save, sender=IngredientToRecipe)
+def recipe_ingredient_saved(sender, instance, raw, **kwargs):
+    if not raw:
+        apply_recipe_amounts(instance.recipe_id,
+                             {instance.ingredient_id: instance.amount})
+    invalidate_recipe_on_commit(instance.recipe_id)
+
+
+@receiver(post_delete, sender=IngredientToRecipe)
+def recipe_ingredient_deleted(sender, instance, **kwargs):
+    apply_recipe_amounts(instance.recipe_id,
+                         {instance.ingredient_id: -instance.amount})
+    invalidate_recipe_on_commit(instance.recipe_id)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('pre_remove', 'pre_clear', 'post_add'):
+        return
+    if reverse:
+        recipes = (Recipe.objects.filter(id__in=pk_set) if pk_set is not None
+                   else instance.recipe_set.all())
+        author_ids = set(recipes.values_list('author_id', flat=True))
+        tag_slugs = [instance.slug]
+    else:
+        tags = (Tag.objects.filter(id__in=pk_set) if pk_set is not None
+                else instance.tags.all())
+        author_ids = [instance.author_id]
+        tag_slugs = list(tags.values_list('slug', flat=True))
+    transaction.on_commit(
+        lambda: catalogue.invalidate_feed(author_ids, tag_slugs))
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields, **kwargs):
+    if created:
+        AuthorStats.objects.create(user=instance)
+        return
+    if update_fields is not None and not FEED_USER_FIELDS & update_fields:
+        return
+    recipes = Recipe.objects.filter(author_id=instance.id)
+    transaction.on_commit(lambda: catalogue.invalidate_recipes(recipes))
@@ -0,0 +1,785 @@
+import io
+import json
+from contextlib import redirect_stdout
+from unittest import mock, skipUnless
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F, Prefetch
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from api import feed_cache, metrics
+from api.management.commands.serializer_benchmark import (
+    BaselineFollowSerializer,
+    BaselineIngredientSerializer,
+    BaselineRecipeMinifiedSerializer,
+    BaselineRecipeSerializer,
+    BaselineTagSerializer,
+    BaselineUserSerializer,
+    comparable
+)
+from api.serializers import (
+    CustomUserSerializer,
+    FollowSerializer,
+    GetRecipeListSerializer,
+    IngredientSerializer,
+    RecipeMinifiedSerializer,
+    TagSerializer
+)
+from recipes import catalogue
+from recipes.images import variant_names
+from recipes.models import (
+    CatalogueVersion,
+    Favorite,
+    Ingredient,
+    IngredientToRecipe,
+    Recipe,
+    ShopList,
+    ShoppingCartItem,
+    Tag
+)
+from users.models import AuthorStats, Follow, User
+
+
+def create_recipes(authors, count):
+    tags = [Tag.objects.create(name='Тег {}'.format(i),
+                               color='#00000{}'.format(i),
+                               slug='tag{}'.format(i))
+            for i in range(3)]
+    ingredients = [Ingredient.objects.create(name='Ингредиент {}'.format(i),
+                                             measurement_unit='г')
+                   for i in range(10)]
+    recipes = []
+    for i in range(count):
+        recipe = Recipe.objects.create(author=authors[i % len(authors)],
+                                       name='Рецепт {}'.format(i),
+                                       image='recipes/images/test.png',
+                                       text='Описание',
+                                       cooking_time=10)
+        recipe.tags.set(tags[:1 + i % len(tags)])
+        IngredientToRecipe.objects.bulk_create([
+            IngredientToRecipe(recipe=recipe,
+                               ingredient=ingredients[(i + j) % 10],
+                               amount=100)
+            for j in range(3)
+        ])
+        recipes.append(recipe)
+    return recipes
+
+
+class RecipeListQueriesTest(TestCase):
+    """Число запросов ленты рецептов не зависит от размера страницы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.authors = [
+            User.objects.create_user(username='author{}'.format(i),
+                                     email='author{}@ya.ru'.format(i),
+                                     password='password')
+            for i in range(5)
+        ]
+        cls.user = User.objects.create_user(username='reader',
+                                            email='reader@ya.ru',
+                                            password='password')
+        recipes = create_recipes(cls.authors, 60)
+        for recipe in recipes[:10]:
+            Favorite.objects.create(user=cls.user, recipe=recipe)
+            ShopList.objects.create(user=cls.user, recipe=recipe)
+        for author in cls.authors[:2]:
+            Follow.objects.create(user=cls.user, author=author)
+
+    def setUp(self):
+        cache.clear()
+        feed_cache.local_cache.clear()
+        self.client = APIClient()
+
+    def assert_same_queries(self, queries):
+        for limit in (6, 50):
+            with self.subTest(limit=limit):
+                with self.assertNumQueries(queries):
+                    response = self.client.get(
+                        '/api/recipes/?limit={}'.format(limit))
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data['results']), limit)
+
+    def test_anonymous(self):
+        self.assert_same_queries(5)
+
+    def test_authenticated(self):
+        self.client.force_authenticate(self.user)
+        self.assert_same_queries(5)
+
+
+class RecipeCursorPaginationTest(TestCase):
+    """Курсорная выдача рецептов с закэшированным количеством."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.recipes = create_recipes([User.objects.create_user(
+            username='author', email='author@ya.ru', password='password')], 15)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_pages_and_cached_count(self):
+        url = '/api/recipes/?cursor=&limit=6'
+        ids = []
+        counts = []
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data['count'], 15)
+            counts.append(sum('COUNT(' in query['sql'].upper()
+                              for query in queries))
+            ids += [recipe['id'] for recipe in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(ids, list(Recipe.objects.order_by(
+            '-pub_date', '-id').values_list('id', flat=True)))
+        self.assertEqual(counts, [1, 0, 0])
+
+
+class ShoppingCartItemTest(TestCase):
+    """Агрегат списка покупок совпадает с исходными таблицами при записи
+    через API, админку и ORM."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author',
+                                              email='author@ya.ru',
+                                              password='password')
+        cls.user = User.objects.create_user(username='buyer',
+                                            email='buyer@ya.ru',
+                                            password='password')
+        cls.recipes = create_recipes([cls.author], 3)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for recipe in self.recipes[:2]:
+            ShopList.objects.create(user=self.user, recipe=recipe)
+
+    def assert_consistent(self):
+        self.assertEqual(
+            set(ShoppingCartItem.objects.values_list('user_id',
+                                                     'ingredient_id',
+                                                     'total_amount')),
+            set(ShoppingCartItem.objects.expected())
+        )
+
+    def download(self):
+        response = self.client.get('/api/recipes/download_shopping_cart/')
+        return b''.join(response.streaming_content).decode()
+
+    def test_shop_list(self):
+        self.assert_consistent()
+        ShopList.objects.filter(recipe=self.recipes[0]).delete()
+        self.assert_consistent()
+        response = self.client.post(
+            '/api/recipes/{}/shopping_cart/'.format(self.recipes[2].id))
+        self.assertEqual(response.status_code, 201)
+        self.assert_consistent()
+        response = self.client.delete(
+            '/api/recipes/{}/shopping_cart/'.format(self.recipes[1].id))
+        self.assertEqual(response.status_code, 204)
+        self.assert_consistent()
+
+    def test_recipe_ingredients(self):
+        before = self.download()
+        row = self.recipes[0].ingredients_recipe.first()
+        row.amount += 50
+        row.save()
+        self.assert_consistent()
+        self.assertNotEqual(self.download(), before)
+        row.ingredient = Ingredient.objects.exclude(
+            ingredients_recipe__recipe=self.recipes[0]).first()
+        row.save()
+        self.assert_consistent()
+        IngredientToRecipe.objects.create(
+            recipe=self.recipes[1],
+            ingredient=Ingredient.objects.exclude(
+                ingredients_recipe__recipe=self.recipes[1]).first(),
+            amount=5)
+        self.assert_consistent()
+        self.recipes[1].ingredients_recipe.first().delete()
+        self.assert_consistent()
+
+    def test_ingredient_renamed(self):
+        self.download()
+        ingredient = self.recipes[0].ingredients.first()
+        ingredient.name = 'Переименованный'
+        ingredient.save()
+        self.assertIn('Переименованный', self.download())
+
+    def test_change_while_streaming(self):
+        response = self.client.get('/api/recipes/download_shopping_cart/')
+        content = iter(response.streaming_content)
+        first = next(content)
+        ShopList.objects.filter(recipe=self.recipes[0]).delete()
+        before = (first + b''.join(content)).decode()
+        self.assertNotEqual(self.download(), before)
+        self.assert_consistent()
+
+    def test_recipe_update(self):
+        self.client.force_authenticate(self.author)
+        recipe = self.recipes[0]
+        ingredients = list(Ingredient.objects.values_list('id', flat=True))
+        response = self.client.patch(
+            '/api/recipes/{}/'.format(recipe.id),
+            data={'tags': list(recipe.tags.values_list('id', flat=True)),
+                  'ingredients': [{'id': pk, 'amount': 7}
+                                  for pk in ingredients[5:9]]},
+            format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assert_consistent()
+
+    def test_recipe_delete(self):
+        self.recipes[0].delete()
+        self.assert_consistent()
+        self.client.force_authenticate(self.author)
+        response = self.client.delete(
+            '/api/recipes/{}/'.format(self.recipes[1].id))
+        self.assertEqual(response.status_code, 204)
+        self.assert_consistent()
+        self.assertFalse(ShoppingCartItem.objects.exists())
+
+
+class ShoppingListUnitsTest(TestCase):
+    """Совместимые единицы ингредиента складываются в выгрузке покупок."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(username='author',
+                                          email='author@ya.ru',
+                                          password='password')
+        cls.user = User.objects.create_user(username='buyer',
+                                            email='buyer@ya.ru',
+                                            password='password')
+        recipe = create_recipes([author], 1)[0]
+        recipe.ingredients_recipe.all().delete()
+        IngredientToRecipe.objects.bulk_create([
+            IngredientToRecipe(recipe=recipe,
+                               ingredient=Ingredient.objects.create(
+                                   name=name, measurement_unit=unit),
+                               amount=amount)
+            for name, unit, amount in (('молоко', 'мл', 200),
+                                       ('молоко', 'л', 1),
+                                       ('молоко', 'стакан', 2),
+                                       ('сахар', 'ст. л.', 2),
+                                       ('соль', 'г', 5),
+                                       ('соль', 'по вкусу', 1))
+        ])
+        ShopList.objects.create(user=cls.user, recipe=recipe)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_merged_totals(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get('/api/recipes/download_shopping_cart/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            sorted(b''.join(response.streaming_content).decode().splitlines()),
+            ['молоко л - 1.7', 'сахар ст. л. - 2', 'соль г - 5',
+             'соль по вкусу - 1'])
+
+
+@skipUnless(connection.vendor == 'postgresql',
+            'Полнотекстовый поиск работает только на PostgreSQL')
+class RecipeSearchTest(TestCase):
+    """Поиск рецептов по словоформам, с весом названия и опечатками."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(username='author',
+                                          email='author@ya.ru',
+                                          password='password')
+        cls.recipes = {}
+        for name, text in (('Борщ', 'Свёкла, морковь и свежая капуста'),
+                           ('Пирог с капустой', 'Тесто и начинка'),
+                           ('Салат оливье', 'Картофель, огурцы, горошек')):
+            cls.recipes[name] = Recipe.objects.create(
+                author=author,
+                name=name,
+                image='recipes/images/test.png',
+                text=text,
+                cooking_time=30)
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, value):
+        response = self.client.get('/api/recipes/', {'search': value})
+        self.assertEqual(response.status_code, 200)
+        return [recipe['name'] for recipe in response.data['results']]
+
+    def test_word_forms_ranked_by_name(self):
+        self.assertEqual(self.search('капуста'),
+                         ['Пирог с капустой', 'Борщ'])
+
+    def test_typo_in_name(self):
+        self.assertEqual(self.search('оливъе'), ['Салат оливье'])
+
+    def test_no_match(self):
+        self.assertEqual(self.search('шоколад'), [])
+
+    def test_vector_updated_on_save(self):
+        recipe = self.recipes['Борщ']
+        recipe.text = 'Свёкла и фасоль'
+        recipe.save()
+        self.assertEqual(self.search('капуста'), ['Пирог с капустой'])
+
+
+class SubscriptionsTest(TestCase):
+    """Ограничение числа рецептов в подписках параметром recipes_limit."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='reader',
+                                            email='reader@ya.ru',
+                                            password='password')
+        cls.authors = [
+            User.objects.create_user(username='author{}'.format(i),
+                                     email='author{}@ya.ru'.format(i),
+                                     password='password')
+            for i in range(3)
+        ]
+        create_recipes(cls.authors, 12)
+        for author in cls.authors[:2]:
+            Follow.objects.create(user=cls.user, author=author)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def recipe_counts(self, query):
+        response = self.client.get('/api/users/subscriptions/' + query)
+        self.assertEqual(response.status_code, 200)
+        return [len(author['recipes'])
+                for author in response.data['results']]
+
+    def test_limit(self):
+        self.assertEqual(self.recipe_counts(''), [4, 4])
+        self.assertEqual(self.recipe_counts('?recipes_limit=2'), [2, 2])
+        self.assertEqual(self.recipe_counts('?recipes_limit=0'), [0, 0])
+
+    def test_invalid_limit(self):
+        for value in ('-1', 'abc', '1.5'):
+            with self.subTest(value=value):
+                response = self.client.get(
+                    '/api/users/subscriptions/?recipes_limit=' + value)
+                self.assertEqual(response.status_code, 400)
+                response = self.client.post(
+                    '/api/users/{}/subscribe/?recipes_limit={}'.format(
+                        self.authors[2].id, value))
+                self.assertEqual(response.status_code, 400)
+        self.assertFalse(Follow.objects.filter(user=self.user,
+                                               author=self.authors[2]))
+
+    def test_subscribe_limit(self):
+        response = self.client.post(
+            '/api/users/{}/subscribe/?recipes_limit=0'.format(
+                self.authors[2].id))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['recipes'], [])
+
+
+class RecipeFeedCacheTest(TestCase):
+    """Правки пользователей сбрасывают только ленты с их рецептами."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author',
+                                              email='author@ya.ru',
+                                              password='password')
+        cls.reader = User.objects.create_user(username='reader',
+                                              email='reader@ya.ru',
+                                              password='password')
+        create_recipes([cls.author], 3)
+
+    def setUp(self):
+        cache.clear()
+        feed_cache.local_cache.clear()
+
+    def assert_cached(self, url):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_signup_and_unrelated_edits_keep_pages(self):
+        self.client.get('/api/recipes/')
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.create_user(username='newcomer',
+                                     email='newcomer@ya.ru',
+                                     password='password')
+            self.reader.first_name = 'Читатель'
+            self.reader.save()
+            self.author.set_password('new-password')
+            self.author.save(update_fields=['password'])
+        self.assert_cached('/api/recipes/')
+
+    def test_author_edit_refreshes_pages(self):
+        url = '/api/recipes/?author={}'.format(self.reader.id)
+        self.client.get('/api/recipes/')
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.first_name = 'Автор'
+            self.author.save()
+        self.assert_cached(url)
+        response = self.client.get('/api/recipes/')
+        self.assertEqual(response.data['results'][0]['author']['first_name'],
+                         'Автор')
+
+
+class CountersTest(TestCase):
+    """Счётчики рецептов и авторов при добавлении и удалении через API."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author',
+                                              email='author@ya.ru',
+                                              password='password')
+        cls.reader = User.objects.create_user(username='reader',
+                                              email='reader@ya.ru',
+                                              password='password')
+        cls.recipes = create_recipes([cls.author], 2)
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def assert_counters(self, recipes_count, followers_count,
+                        favorites_count, shop_list_count):
+        stats = AuthorStats.objects.get(user=self.author)
+        recipe = Recipe.objects.get(id=self.recipes[0].id)
+        self.assertEqual(
+            (stats.recipes_count, stats.followers_count,
+             recipe.favorites_count, recipe.shop_list_count),
+            (recipes_count, followers_count, favorites_count,
+             shop_list_count))
+
+    def test_create_and_delete(self):
+        self.assert_counters(2, 0, 0, 0)
+        reader = self.client_for(self.reader)
+        recipe_url = '/api/recipes/{}/'.format(self.recipes[0].id)
+        subscribe_url = '/api/users/{}/subscribe/'.format(self.author.id)
+        for url in (recipe_url + 'favorite/',
+                    recipe_url + 'shopping_cart/',
+                    subscribe_url):
+            self.assertEqual(reader.post(url).status_code, 201)
+        self.assert_counters(2, 1, 1, 1)
+        for url in (recipe_url + 'favorite/', subscribe_url):
+            self.assertEqual(reader.delete(url).status_code, 204)
+        response = self.client_for(self.author).delete(
+            '/api/recipes/{}/'.format(self.recipes[1].id))
+        self.assertEqual(response.status_code, 204)
+        self.assert_counters(1, 0, 0, 1)
+        with redirect_stdout(io.StringIO()):
+            call_command('counters', '--verify')
+
+
+class RecipeUpdateTest(TestCase):
+    """Изменение рецепта не перезаписывает вычисляемые столбцы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author',
+                                              email='author@ya.ru',
+                                              password='password')
+        cls.reader = User.objects.create_user(username='reader',
+                                              email='reader@ya.ru',
+                                              password='password')
+        cls.recipe = create_recipes([cls.author], 1)[0]
+
+    def setUp(self):
+        cache.clear()
+        feed_cache.local_cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def test_all_tags_after_patch(self):
+        tags = list(Tag.objects.exclude(recipe=self.recipe)[:2])
+        ingredient = Ingredient.objects.first()
+        response = self.client.patch(
+            '/api/recipes/{}/'.format(self.recipe.id),
+            data={'tags': [tag.id for tag in tags],
+                  'ingredients': [{'id': ingredient.id, 'amount': 5}]},
+            format='json')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(
+            '/api/recipes/?tags_mode=all&tags={}&tags={}'.format(
+                tags[0].slug, tags[1].slug))
+        self.assertEqual([recipe['id'] for recipe in response.data['results']],
+                         [self.recipe.id])
+
+    def test_counters_and_variants_kept(self):
+        recipe = Recipe.objects.get(id=self.recipe.id)
+        Favorite.objects.create(user=self.reader, recipe=recipe)
+        ShopList.objects.create(user=self.reader, recipe=recipe)
+        Recipe.objects.filter(id=recipe.id).update(
+            image_variants={'480': 'recipes/images/variants/test-480.webp'})
+        recipe.name = 'Новое название'
+        recipe.save()
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.name, 'Новое название')
+        self.assertEqual((recipe.favorites_count, recipe.shop_list_count),
+                         (1, 1))
+        self.assertEqual(recipe.image_variants,
+                         {'480': 'recipes/images/variants/test-480.webp'})
+
+
+class SerializerBaselineTest(TestCase):
+    """Ответы совпадают с исходными сериализаторами на полях DRF."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='reader',
+                                            email='reader@ya.ru',
+                                            password='password')
+        cls.authors = [
+            User.objects.create_user(username='author{}'.format(i),
+                                     email='author{}@ya.ru'.format(i),
+                                     password='password')
+            for i in range(2)
+        ]
+        recipes = create_recipes(cls.authors, 6)
+        Recipe.objects.filter(id=recipes[0].id).update(
+            image_variants=variant_names(recipes[0].image.name))
+        Follow.objects.create(user=cls.user, author=cls.authors[0])
+        Follow.objects.create(user=cls.authors[1], author=cls.authors[0])
+        Favorite.objects.create(user=cls.user, recipe=recipes[0])
+        ShopList.objects.create(user=cls.user, recipe=recipes[1])
+
+    def serialize(self, serializer_class, objects, user, query=None):
+        request = Request(APIRequestFactory().get('/api/recipes/', query))
+        request.user = user
+        return serializer_class(objects,
+                                many=True,
+                                context={'request': request}).data
+
+    def assert_same(self, serializer_class, baseline_class, objects,
+                    user, query=None):
+        data = self.serialize(serializer_class, objects, user, query)
+        baseline = self.serialize(baseline_class, objects, user, query)
+        self.assertEqual(
+            json.dumps(comparable(data), ensure_ascii=False, indent=1),
+            json.dumps(comparable(baseline), ensure_ascii=False, indent=1))
+        return data, baseline
+
+    def test_recipes(self):
+        for user in (self.user, AnonymousUser()):
+            with self.subTest(user=user):
+                recipes = list(Recipe.objects.with_user_flags(
+                    user).with_related(user))
+                data, baseline = self.assert_same(GetRecipeListSerializer,
+                                                  BaselineRecipeSerializer,
+                                                  recipes,
+                                                  user)
+                for recipe, old in zip(data, baseline):
+                    self.assertEqual(set(recipe) - set(old),
+                                     {'image_variants'})
+                self.assertTrue(any(recipe['image_variants']
+                                    for recipe in data))
+                self.assert_same(RecipeMinifiedSerializer,
+                                 BaselineRecipeMinifiedSerializer,
+                                 recipes,
+                                 user)
+
+    def test_subscriptions(self):
+        for recipes_limit in (None, 2):
+            with self.subTest(recipes_limit=recipes_limit):
+                follows = Follow.objects.filter(
+                    user=self.user
+                ).select_related('author__stats').prefetch_related(Prefetch(
+                    'author__recipes',
+                    queryset=Recipe.objects.latest_per_author(recipes_limit),
+                    to_attr='latest_recipes'
+                ))
+                query = {} if recipes_limit is None else {
+                    'recipes_limit': recipes_limit}
+                self.assert_same(FollowSerializer,
+                                 BaselineFollowSerializer,
+                                 list(follows),
+                                 self.user,
+                                 query)
+
+    def test_catalogue(self):
+        for user in (self.user, AnonymousUser()):
+            with self.subTest(user=user):
+                self.assert_same(CustomUserSerializer,
+                                 BaselineUserSerializer,
+                                 list(User.objects.all()),
+                                 user)
+        self.assert_same(TagSerializer,
+                         BaselineTagSerializer,
+                         list(Tag.objects.all()),
+                         self.user)
+        self.assert_same(IngredientSerializer,
+                         BaselineIngredientSerializer,
+                         list(Ingredient.objects.all()),
+                         self.user)
+
+
+class IngredientAutocompleteTest(TestCase):
+    """Автодополнение видит изменения справочника из других процессов."""
+
+    def names(self, query):
+        response = self.client.get('/api/ingredients/?name=' + query)
+        self.assertEqual(response.status_code, 200)
+        return [ingredient['name'] for ingredient in response.data]
+
+    def test_version_shared_through_database(self):
+        Ingredient.objects.create(name='абрикосы', measurement_unit='г')
+        self.assertEqual(self.names('абрик'), ['абрикосы'])
+        # Другой процесс: без сигналов и со своим кэшем, общая только база.
+        Ingredient.objects.bulk_create([
+            Ingredient(name='абрикосовый джем', measurement_unit='г')])
+        cache.clear()
+        CatalogueVersion.objects.filter(
+            name=catalogue.INGREDIENTS).update(version=F('version') + 1)
+        self.assertEqual(self.names('абрик'),
+                         ['абрикосовый джем', 'абрикосы'])
+
+
+class CatalogueCacheTest(TestCase):
+    """ETag и 304 для тегов и ингредиентов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        create_recipes([User.objects.create_user(username='author',
+                                                 email='author@ya.ru',
+                                                 password='password')], 1)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_not_modified(self):
+        for url in ('/api/tags/', '/api/ingredients/'):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                with self.assertNumQueries(1):
+                    response = self.client.get(
+                        url, HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(response.status_code, 304)
+
+    def test_detail(self):
+        tag = Tag.objects.get(slug='tag0')
+        url = '/api/tags/{}/'.format(tag.id)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(1):
+            not_modified = self.client.get(
+                url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+        tag.name = 'Ужин'
+        tag.save()
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.data['name'], 'Ужин')
+
+    def test_change_from_other_process(self):
+        etag = self.client.get('/api/tags/')['ETag']
+        # Другой процесс: без сигналов и со своим кэшем, общая только база.
+        Tag.objects.filter(slug='tag0').update(name='Завтрак')
+        cache.clear()
+        CatalogueVersion.objects.filter(
+            name=catalogue.TAGS).update(version=F('version') + 1)
+        response = self.client.get('/api/tags/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn('Завтрак', [tag['name'] for tag in response.data])
+
+
+class QueryMetricsTest(TestCase):
+    """Метрики запросов, бюджет запросов и заголовок Server-Timing."""
+
+    @classmethod
+    def setUpTestData(cls):
+        create_recipes([User.objects.create_user(username='author',
+                                                 email='author@ya.ru',
+                                                 password='password')], 3)
+
+    def setUp(self):
+        cache.clear()
+        feed_cache.local_cache.clear()
+        registry = mock.patch.object(metrics, 'registry', metrics.Registry())
+        self.registry = registry.start()
+        self.addCleanup(registry.stop)
+
+    def test_route_metrics(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/recipes/')
+        count = len(queries)
+        self.client.get('/api/unknown/')
+        lines = self.registry.render().splitlines()
+        for line in (
+                'foodgram_requests_total{route="recipes-list",method="GET",'
+                'status="200"} 1',
+                'foodgram_requests_total{route="unresolved",method="GET",'
+                'status="404"} 1',
+                'foodgram_db_queries_total{{route="recipes-list"}} '
+                '{}'.format(count),
+                'foodgram_request_duration_seconds_count'
+                '{route="recipes-list"} 1'):
+            with self.subTest(line=line):
+                self.assertIn(line, lines)
+
+    def test_streaming_counted_after_body(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.get(username='author'))
+        response = client.get('/api/recipes/download_shopping_cart/')
+        route = 'route="recipes-download-shopping-cart"'
+        self.assertNotIn(route, self.registry.render())
+        b''.join(response.streaming_content)
+        self.assertIn(route, self.registry.render())
+
+    @override_settings(QUERY_BUDGETS={'recipes-list': 1},
+                       QUERY_BUDGET_RAISE=True)
+    def test_budget_exceeded_raises(self):
+        with self.assertRaisesRegex(
+                metrics.QueryBudgetExceeded,
+                r'^GET recipes-list: \d+ запросов к базе при бюджете 1$'):
+            self.client.get('/api/recipes/')
+        self.assertIn('foodgram_budget_exceeded_total'
+                      '{route="recipes-list"} 1',
+                      self.registry.render().splitlines())
+
+    @override_settings(QUERY_BUDGETS={'recipes-list': 1,
+                                      'GET recipes-list': 100},
+                       QUERY_BUDGET_RAISE=True)
+    def test_method_budget_preferred(self):
+        self.assertEqual(self.client.get('/api/recipes/').status_code, 200)
+
+    @override_settings(QUERY_BUDGETS={'recipes-list': 1})
+    def test_budget_exceeded_logged(self):
+        with self.assertLogs('api.metrics', 'WARNING'):
+            response = self.client.get('/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(METRICS_ALLOWED_IPS=['127.0.0.1'])
+    def test_metrics_only_for_allowed_ips(self):
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('# TYPE foodgram_requests_total counter',
+                      response.content.decode())
+        response = self.client.get('/api/metrics/', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 404)
+
+    def test_server_timing(self):
+        with override_settings(SERVER_TIMING=True):
+            response = self.client.get('/api/recipes/')
+        self.assertRegex(response['Server-Timing'],
+                         r'^db;dur=[\d.]+;desc="\d+ queries", '
+                         r'serializer;dur=[\d.]+, total;dur=[\d.]+$')
+        with override_settings(SERVER_TIMING=False):
+            response = self.client.get('/api/recipes/')
+        self.assertFalse(response.has_header('Server-Timing'))
@@ -5,7 +5,8 @@ from api.views import (
     CustomUserViewSet,
     IngredientViewSet,
     RecipeViewSet,
-    TagViewSet
+    TagViewSet,
+    metrics_view
 )
 
 app_name = 'api'
@@ -26,6 +27,7 @@ router_v1.register('recipes',
                    basename='recipes')
 
 urlpatterns = [
+    path('metrics/', metrics_view, name='metrics'),
     path('', include(router_v1.urls)),
     path('', include('djoser.urls')),
     re_path(r'^auth/', include('djoser.urls.authtoken')),
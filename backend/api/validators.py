@@ -13,3 +13,17 @@ def validate_following(data, user):
         raise ValidationError('Нельзя подписаться на самого себя!')
 
     return data
+
+
+def validate_recipes_limit(value):
+    """Параметр recipes_limit: None без ограничения или число от нуля."""
+    if value is None or value == '':
+        return None
+    try:
+        limit = int(value)
+    except ValueError:
+        limit = -1
+    if limit < 0:
+        raise ValidationError(
+            {'recipes_limit': 'Укажите неотрицательное целое число'})
+    return limit
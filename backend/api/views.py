@@ -1,19 +1,23 @@
-from django.db.models import Sum
+from django.db import transaction
+from django.db.models import Prefetch
 from django_filters.rest_framework import DjangoFilterBackend
-from django.http import HttpResponse
+from django.conf import settings
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from djoser.views import UserViewSet
 
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.filters import SearchFilter
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.viewsets import ModelViewSet
 
+from api import feed_cache, metrics, shopping_list
 from api.filters import IngredientFilter, RecipeFilter
-from api.mixins import CustomUserMixin
-from api.pagination import CustomPaginator
+from api.mixins import CatalogueCacheMixin
+from api.pagination import CustomPaginator, RecipePaginator
 from api.permissions import IsAuthorOrAdminOrReadOnly
 from api.serializers import (
     CreateRecipeSerializer,
@@ -25,25 +29,31 @@ from api.serializers import (
     GetRecipeListSerializer,
     TagSerializer
 )
+from api.validators import validate_recipes_limit
+from recipes import catalogue, recommendations
+from recipes.ingredient_index import ingredient_index
+from recipes.pantry_index import pantry_index
 from recipes.models import (
     Favorite,
     Ingredient,
-    IngredientToRecipe,
     Recipe,
     ShopList,
+    ShoppingCartItem,
     Tag
 )
 from users.models import Follow, User
 
 
-class TagViewSet(CustomUserMixin):
+class TagViewSet(CatalogueCacheMixin):
+    catalogue_name = catalogue.TAGS
     serializer_class = TagSerializer
     queryset = Tag.objects.all()
     permission_classes = (IsAuthorOrAdminOrReadOnly,)
     pagination_class = None
 
 
-class IngredientViewSet(CustomUserMixin):
+class IngredientViewSet(CatalogueCacheMixin):
+    catalogue_name = catalogue.INGREDIENTS
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = (IsAuthorOrAdminOrReadOnly,)
@@ -51,6 +61,12 @@ class IngredientViewSet(CustomUserMixin):
     filterset_class = IngredientFilter
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if not name:
+            return super().list(request, *args, **kwargs)
+        return Response(ingredient_index.search(name))
+
 
 class CustomUserViewSet(UserViewSet):
     queryset = User.objects.all()
@@ -61,7 +77,15 @@ class CustomUserViewSet(UserViewSet):
 
     @action(detail=False, methods=['GET'])
     def subscriptions(self, request):
-        follower = Follow.objects.filter(user=request.user)
+        recipes_limit = validate_recipes_limit(
+            request.query_params.get('recipes_limit'))
+        follower = Follow.objects.filter(
+            user=request.user
+        ).select_related('author__stats').prefetch_related(Prefetch(
+            'author__recipes',
+            queryset=Recipe.objects.latest_per_author(recipes_limit),
+            to_attr='latest_recipes'
+        ))
         page = self.paginate_queryset(follower)
         serializer = FollowSerializer(page,
                                       many=True,
@@ -74,6 +98,7 @@ class CustomUserViewSet(UserViewSet):
         author = get_object_or_404(User, id=id)
 
         if request.method == 'POST':
+            validate_recipes_limit(request.query_params.get('recipes_limit'))
             follower = Follow.objects.create(user=user, author=author)
             serializer = FollowSerializer(follower,
                                           context={'request': request})
@@ -91,15 +116,43 @@ class RecipeViewSet(ModelViewSet):
     permission_classes = (IsAuthorOrAdminOrReadOnly,)
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
-    pagination_class = CustomPaginator
+    pagination_class = RecipePaginator
     http_method_names = ['get', 'post', 'patch', 'delete']
 
+    def get_queryset(self):
+        user = self.request.user
+        queryset = Recipe.objects.with_user_flags(user)
+        if self.request.method == 'GET':
+            return queryset.with_related(user)
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        key = feed_cache.get_key(request)
+        if key is None:
+            return super().list(request, *args, **kwargs)
+        data = feed_cache.load(key)
+        if data is None:
+            response = super().list(request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                feed_cache.store(key, response.data)
+            return response
+        return Response(feed_cache.get_response_data(request, data))
+
     def perform_create(self, serializer):
         return serializer.save(author=self.request.user)
 
     def perform_update(self, serializer):
         return serializer.save(author=self.request.user)
 
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        with shopping_list.batch(instance.id):
+            user_ids = list(instance.shop_list.values_list('user_id',
+                                                           flat=True))
+            ShoppingCartItem.objects.remove_recipe(user_ids, instance.id)
+            shopping_list.invalidate(*user_ids)
+            instance.delete()
+
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -116,6 +169,48 @@ class RecipeViewSet(ModelViewSet):
             return GetRecipeListSerializer
         return CreateRecipeSerializer
 
+    def ordered_recipes(self, ids):
+        recipes = self.get_queryset().in_bulk(ids)
+        serializer = self.get_serializer(
+            [recipes[pk] for pk in ids if pk in recipes],
+            many=True
+        )
+        return Response(serializer.data)
+
+    @action(detail=True, methods=['GET'])
+    def similar(self, request, pk):
+        recipe = get_object_or_404(Recipe, id=pk)
+        return self.ordered_recipes(recommendations.similar_ids(recipe.id))
+
+    @action(detail=False,
+            methods=['GET'],
+            permission_classes=(IsAuthenticated,))
+    def recommended(self, request):
+        return self.ordered_recipes(
+            recommendations.recommended_ids(request.user))
+
+    @action(detail=False, methods=['GET'])
+    def pantry(self, request):
+        values = [value
+                  for param in request.query_params.getlist('ingredients')
+                  for value in param.split(',') if value]
+        if not values or not all(value.isdigit() for value in values):
+            raise ValidationError(
+                {'ingredients': 'Укажите id ингредиентов через запятую'})
+        page = self.paginate_queryset(
+            pantry_index.search(int(value) for value in values))
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, _, _ in page])
+        found = [(recipes[recipe_id], matched, missing)
+                 for recipe_id, matched, missing in page
+                 if recipe_id in recipes]
+        data = self.get_serializer([recipe for recipe, _, _ in found],
+                                   many=True).data
+        for item, (_, matched, missing) in zip(data, found):
+            item['matched_ingredients'] = matched
+            item['missing_ingredients'] = missing
+        return self.get_paginated_response(data)
+
     @action(detail=True, methods=['POST'])
     def shopping_cart(self, request, pk):
         recipe = get_object_or_404(Recipe, id=pk)
@@ -131,6 +226,7 @@ class RecipeViewSet(ModelViewSet):
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     @shopping_cart.mapping.delete
+    @transaction.atomic
     def delete_shopping_cart(self, request, pk):
         get_object_or_404(ShopList,
                           recipe__id=pk,
@@ -157,27 +253,34 @@ class RecipeViewSet(ModelViewSet):
                           user=request.user).delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-    @action(detail=False, methods=['GET'])
+    @action(detail=False,
+            methods=['GET'],
+            permission_classes=(IsAuthenticated,))
     def download_shopping_cart(self, request):
-        ingredients = IngredientToRecipe.objects.filter(
-            recipe__shop_list__user=request.user
-        ).values('ingredient__name',
-                 'ingredient__measurement_unit'
-                 ).annotate(amount=Sum('amount'))
+        file_type = request.query_params.get('type', 'txt')
+        if file_type not in shopping_list.FORMATS:
+            raise ValidationError(
+                {'type': 'Доступные форматы: {}'.format(
+                    ', '.join(shopping_list.FORMATS))}
+            )
+        content_type, render = shopping_list.FORMATS[file_type]
 
-        shop_list = ''
-        for ingredient in ingredients:
-            name = ingredient.get('ingredient__name')
-            unit = ingredient.get('ingredient__measurement_unit')
-            amount = ingredient.get('amount')
-
-            shop_list += '{} {} - {}\n'.format(name, unit, amount)
-
-        filename = 'shop_list.txt'
+        filename = 'shop_list.{}'.format(file_type)
         headers = {
             'Content-Disposition': 'attachment; filename={}'.format(filename)
         }
 
-        return HttpResponse(shop_list,
-                            content_type='text/plain; charset=UTF-8',
-                            headers=headers)
+        return StreamingHttpResponse(
+            render(shopping_list.get_rows(request.user)),
+            content_type=content_type,
+            headers=headers
+        )
+
+
+def metrics_view(request):
+    """Метрики процесса в формате Prometheus, только для своих адресов."""
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        raise Http404
+    return HttpResponse(metrics.registry.render(),
+                        content_type='text/plain; version=0.0.4; '
+                                     'charset=utf-8')
@@ -16,6 +16,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'recipes',
     'users',
     'api',
@@ -26,6 +27,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.QueryMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -63,9 +65,66 @@ DATABASES = {
         'USER': config('POSTGRES_USER', default='postgres', cast=str),
         'PASSWORD': config('POSTGRES_PASSWORD', default='1234', cast=str),
         'HOST': config('DB_HOST', default='db', cast=str),
-        'PORT': config('DB_PORT', default='5432', cast=int)
+        'PORT': config('DB_PORT', default='5432', cast=int),
     }
 }
+if DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql':
+    # Порог похожести для нечёткого поиска рецептов по названию
+    DATABASES['default']['OPTIONS'] = {
+        'options': '-c pg_trgm.word_similarity_threshold=0.3',
+    }
+
+CACHES = {
+    'default': {
+        'BACKEND': config(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache',
+            cast=str),
+        'LOCATION': config('CACHE_LOCATION', default='', cast=str),
+    }
+}
+
+# Хранить страницы ленты рецептов не только в памяти процесса,
+# но и в общем кэше
+RECIPE_FEED_SHARED_CACHE = config('RECIPE_FEED_SHARED_CACHE',
+                                  default=False,
+                                  cast=bool)
+
+# Метрики запросов: заголовок Server-Timing и адреса, с которых можно
+# забрать /api/metrics/
+SERVER_TIMING = config('SERVER_TIMING', default=DEBUG, cast=bool)
+METRICS_ALLOWED_IPS = config('METRICS_ALLOWED_IPS',
+                             default='127.0.0.1,::1',
+                             cast=Csv())
+
+# Сколько запросов к базе допустимо на один ответ маршрута. При
+# превышении пишется предупреждение, а с QUERY_BUDGET_RAISE ответ
+# завершается ошибкой, чтобы N+1 ловился в тестах. Ключ «МЕТОД маршрут»
+# важнее ключа с одним маршрутом
+QUERY_BUDGETS = {
+    'recipes-list': 8,
+    'POST recipes-list': 25,
+    'recipes-detail': 8,
+    'PATCH recipes-detail': 40,
+    'DELETE recipes-detail': 35,
+    'recipes-similar': 8,
+    'recipes-recommended': 8,
+    'recipes-pantry': 8,
+    'recipes-favorite': 8,
+    'recipes-shopping-cart': 12,
+    'recipes-download-shopping-cart': 3,
+    'users-list': 5,
+    'users-detail': 5,
+    'users-me': 3,
+    'users-subscriptions': 6,
+    'users-subscribe': 8,
+    'tags-list': 2,
+    'tags-detail': 2,
+    'ingredients-list': 2,
+    'ingredients-detail': 2,
+}
+QUERY_BUDGET_DEFAULT = None
+QUERY_BUDGET_RAISE = config('QUERY_BUDGET_RAISE', default=False, cast=bool)
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -97,6 +156,9 @@ STATIC_ROOT = BASE_DIR / 'static'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# Фото рецептов названы по хэшу содержимого и не меняются, поэтому их
+# можно отдавать с CDN, указав здесь его адрес, например https://cdn/media/
+MEDIA_CDN_URL = config('MEDIA_CDN_URL', default='', cast=str)
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -33,21 +33,18 @@ class IngredientToRecipeInlineAdmin(admin.TabularInline):
 class RecipeAdmin(admin.ModelAdmin):
     list_display = ('name',
                     'author',
-                    'favorites_count')
+                    'favorites_count',
+                    'shop_list_count')
     list_filter = ('name',
                    'author__username',
                    'tags__name')
     search_fields = ('name',
                      'author__username',
                      'tags__name')
-    readonly_fields = ('favorites_count',)
+    readonly_fields = ('favorites_count',
+                       'shop_list_count')
     inlines = [IngredientToRecipeInlineAdmin]
 
-    def favorites_count(self, obj):
-        return obj.favorites.count()
-
-    favorites_count.short_description = 'Добавлено в избранное'
-
 
 class ShopListAdmin(admin.ModelAdmin):
     list_display = ('user', 'recipe')
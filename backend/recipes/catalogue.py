@@ -0,0 +1,86 @@
+import time
+
+from django.core.cache import cache
+
+VERSION_KEY = 'catalogue_version:{}'
+PAYLOAD_KEY = 'catalogue:{}:{}:{}'
+PAYLOAD_TIMEOUT = 60 * 60 * 24
+TAGS = 'tags'
+INGREDIENTS = 'ingredients'
+FEED = 'recipe_feed'
+FEED_ALL = 'recipe_feed:all'
+FEED_AUTHOR = 'recipe_feed:author:{}'
+FEED_TAG = 'recipe_feed:tag:{}'
+# Версии справочников хранятся в базе: их меняют команды загрузки
+# данных и другие процессы, которым кэш этого процесса не виден.
+SHARED = frozenset((TAGS, INGREDIENTS))
+
+
+def get_versions(*names):
+    """Версии каталогов: время последнего изменения в наносекундах."""
+    from recipes.models import CatalogueVersion
+
+    versions = {}
+    shared = [name for name in names if name in SHARED]
+    if shared:
+        versions.update(CatalogueVersion.objects.filter(
+            name__in=shared).values_list('name', 'version'))
+    keys = {VERSION_KEY.format(name): name
+            for name in names if name not in SHARED}
+    versions.update((keys[key], version)
+                    for key, version in cache.get_many(keys).items())
+    missing = [name for name in names if name not in versions]
+    if missing:
+        versions.update(dict.fromkeys(missing, bump(*missing)))
+    return versions
+
+
+def get_version(name):
+    return get_versions(name)[name]
+
+
+def bump(*names):
+    from recipes.models import CatalogueVersion
+
+    version = time.time_ns()
+    for name in SHARED.intersection(names):
+        CatalogueVersion.objects.update_or_create(
+            name=name,
+            defaults={'version': version}
+        )
+    cache.set_many({VERSION_KEY.format(name): version
+                    for name in names if name not in SHARED},
+                   None)
+    return version
+
+
+def get_payload(name, version, key):
+    return cache.get(PAYLOAD_KEY.format(name, version, key))
+
+
+def set_payload(name, version, key, data):
+    cache.set(PAYLOAD_KEY.format(name, version, key), data, PAYLOAD_TIMEOUT)
+
+
+def feed_names(author_ids=(), tag_slugs=()):
+    """Версии лент рецептов, которые зависят от авторов и тегов."""
+    return ([FEED_AUTHOR.format(author_id) for author_id in author_ids]
+            + [FEED_TAG.format(slug) for slug in tag_slugs])
+
+
+def invalidate_feed(author_ids=(), tag_slugs=()):
+    bump(FEED_ALL, *feed_names(author_ids, tag_slugs))
+
+
+def invalidate_recipes(recipes):
+    """Сбрасывает ленты, в которые входят рецепты из queryset."""
+    from recipes.models import Tag
+
+    author_ids = set(recipes.values_list('author_id', flat=True))
+    if not author_ids:
+        return
+    invalidate_feed(
+        author_ids,
+        set(Tag.objects.filter(recipe__in=recipes).values_list('slug',
+                                                               flat=True))
+    )
@@ -0,0 +1,155 @@
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.core.files.storage import FileSystemStorage
+from django.db import close_old_connections, connections, transaction
+from django.utils.deconstruct import deconstructible
+from PIL import Image, ImageOps, JpegImagePlugin
+
+VARIANT_WIDTHS = (480, 960)
+VARIANT_FORMAT = 'webp'
+VARIANT_QUALITY = 80
+HASH_NAME_RE = re.compile(r'^[0-9a-f]{64}$')
+
+logger = logging.getLogger(__name__)
+executor = ThreadPoolExecutor(max_workers=2,
+                              thread_name_prefix='recipe-images')
+
+
+@deconstructible
+class HashedStorage(FileSystemStorage):
+    """Хранилище для файлов с именем по хэшу содержимого.
+
+    Одинаковые загрузки получают одно и то же имя, поэтому повторный
+    файл не записывается. Остальные имена, например из админки,
+    получают свободное имя как обычно.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        if is_hashed_name(name):
+            return name
+        return super().get_available_name(name, max_length)
+
+    def _save(self, name, content):
+        if is_hashed_name(name) and self.exists(name):
+            return name
+        return super()._save(name, content)
+
+
+def is_hashed_name(name):
+    stem = os.path.splitext(os.path.basename(name))[0]
+    return HASH_NAME_RE.match(stem) is not None
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def variant_names(name, widths=VARIANT_WIDTHS):
+    directory, filename = os.path.split(name)
+    stem = os.path.splitext(filename)[0]
+    return {str(width): os.path.join(directory,
+                                     'variants',
+                                     '{}-{}.{}'.format(stem,
+                                                       width,
+                                                       VARIANT_FORMAT))
+            for width in widths}
+
+
+def variant_name(name, width):
+    return variant_names(name, (width,))[str(width)]
+
+
+def has_variants(recipe):
+    return recipe.image_variants == variant_names(recipe.image.name)
+
+
+def schedule(recipe):
+    """Ставит обработку фото рецепта в очередь после коммита."""
+    if not recipe.image or has_variants(recipe):
+        return
+    name = recipe.image.name
+    transaction.on_commit(lambda: executor.submit(run_in_thread, name))
+
+
+def run_in_thread(name):
+    close_old_connections()
+    try:
+        process(name)
+    except Exception:
+        logger.exception('Не удалось обработать фото %s', name)
+    finally:
+        connections.close_all()
+
+
+def replace(storage, name, data):
+    """Записывает файл под временным именем и подменяет им name.
+
+    Рецепты с тем же фото и параллельная обработка видят либо старый,
+    либо новый файл целиком.
+    """
+    path = storage.path(name)
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    handle, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as file:
+            file.write(data)
+        os.chmod(temp_path, storage.file_permissions_mode or 0o644)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def without_exif(image, original):
+    """Фото без EXIF; JPEG пережимается с таблицами оригинала."""
+    options = {}
+    if original.format == 'JPEG':
+        options = {'qtables': original.quantization,
+                   'subsampling': JpegImagePlugin.get_sampling(original)}
+    if 'icc_profile' in original.info:
+        options['icc_profile'] = original.info['icc_profile']
+    buffer = BytesIO()
+    image.save(buffer, format=original.format, **options)
+    return buffer.getvalue()
+
+
+def process(name):
+    """Убирает EXIF из оригинала и сохраняет уменьшенные копии в WebP."""
+    from recipes import catalogue
+    from recipes.models import Recipe
+
+    storage = Recipe._meta.get_field('image').storage
+    with storage.open(name) as file:
+        original = Image.open(file)
+        original.load()
+
+    image = original
+    if original.getexif():
+        image = ImageOps.exif_transpose(original)
+        image.info.pop('exif', None)
+        replace(storage, name, without_exif(image, original))
+
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info
+                              else 'RGB')
+    variants = {}
+    for width in VARIANT_WIDTHS:
+        variants[str(width)] = variant_name(name, width)
+        if storage.exists(variants[str(width)]):
+            continue
+        variant = image.copy()
+        variant.thumbnail((width, width * 4))
+        buffer = BytesIO()
+        variant.save(buffer, format=VARIANT_FORMAT, quality=VARIANT_QUALITY)
+        replace(storage, variants[str(width)], buffer.getvalue())
+
+    recipes = Recipe.objects.filter(image=name)
+    if recipes.update(image_variants=variants):
+        catalogue.invalidate_recipes(recipes)
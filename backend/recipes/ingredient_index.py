@@ -0,0 +1,120 @@
+import bisect
+import threading
+
+from recipes import catalogue
+from recipes.models import Ingredient
+
+MAX_RESULTS = 20
+
+
+def normalize(value):
+    return value.strip().lower().replace('ё', 'е')
+
+
+def edit_distance(first, second, limit):
+    """Расстояние Левенштейна, обрезанное сверху значением limit + 1."""
+    if abs(len(first) - len(second)) > limit:
+        return limit + 1
+    previous = list(range(len(second) + 1))
+    for i, char in enumerate(first, 1):
+        current = [i]
+        for j, other in enumerate(second, 1):
+            current.append(min(previous[j] + 1,
+                               current[j - 1] + 1,
+                               previous[j - 1] + (char != other)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class IngredientIndex:
+    """Индекс ингредиентов в памяти процесса для автодополнения.
+
+    Названия хранятся в отсортированных списках: целиком и по началу
+    каждого слова, поэтому поиск по префиксу сводится к bisect. Индекс
+    перестраивается, когда меняется версия справочника ингредиентов.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._items = {}
+        self._names = []
+        self._words = []
+
+    def invalidate(self):
+        return catalogue.bump(catalogue.INGREDIENTS)
+
+    def search(self, query, limit=MAX_RESULTS):
+        self._refresh()
+        items, names, words = self._items, self._names, self._words
+        query = normalize(query)
+        if not query:
+            return []
+
+        found = []
+        seen = set()
+
+        def collect(ids):
+            for pk in ids:
+                if len(found) == limit:
+                    return
+                if pk not in seen:
+                    seen.add(pk)
+                    found.append(items[pk])
+
+        collect(pk for _, pk in self._prefix_range(names, query))
+        collect(pk for _, pk in self._prefix_range(words, query))
+        if len(found) < limit:
+            collect(pk for name, pk in names if query in name)
+        if len(found) < limit and len(query) >= 3:
+            collect(self._fuzzy(query, names, words))
+        return found
+
+    @staticmethod
+    def _prefix_range(keys, query):
+        start = bisect.bisect_left(keys, (query,))
+        end = bisect.bisect_left(keys, (query + '\uffff',))
+        return keys[start:end]
+
+    @staticmethod
+    def _fuzzy(query, names, words):
+        limit = 1 if len(query) <= 5 else 2
+        distances = {}
+        for key, pk in names + words:
+            distance = edit_distance(query, key[:len(query)], limit)
+            if distance <= limit and distance < distances.get(pk, limit + 1):
+                distances[pk] = distance
+        return sorted(distances, key=lambda pk: distances[pk])
+
+    def _refresh(self):
+        version = catalogue.get_version(catalogue.INGREDIENTS)
+        if version == self._version:
+            return
+        with self._lock:
+            if version == self._version:
+                return
+            self._build()
+            self._version = version
+
+    def _build(self):
+        items = {}
+        names = []
+        words = []
+        for pk, name, unit in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit').iterator():
+            items[pk] = {'id': pk, 'name': name, 'measurement_unit': unit}
+            key = normalize(name)
+            names.append((key, pk))
+            position = 0
+            for word in key.split(' '):
+                if position:
+                    words.append((key[position:], pk))
+                position += len(word) + 1
+        names.sort()
+        words.sort()
+        self._items, self._names, self._words = items, names, words
+
+
+ingredient_index = IngredientIndex()
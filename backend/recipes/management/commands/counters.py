@@ -0,0 +1,73 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favorite, Recipe, ShopList
+from users.models import AuthorStats, Follow, User
+
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'shop_list_count', ShopList, 'recipe'),
+    (AuthorStats, 'recipes_count', Recipe, 'author'),
+    (AuthorStats, 'followers_count', Follow, 'author'),
+)
+
+
+def expected_count(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(
+            **{field: OuterRef('pk')}
+        ).order_by().values(field).annotate(
+            count=Count('pk')
+        ).values('count')
+    ), 0)
+
+
+class Command(BaseCommand):
+    help = 'Пересчёт или проверка счётчиков рецептов и авторов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify',
+                            action='store_true',
+                            help='Только сравнить счётчики с данными')
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            self.verify()
+        else:
+            self.rebuild()
+
+    @transaction.atomic
+    def rebuild(self):
+        user_ids = User.objects.filter(
+            stats__isnull=True
+        ).values_list('id', flat=True)
+        AuthorStats.objects.bulk_create(
+            [AuthorStats(user_id=user_id) for user_id in user_ids.iterator()],
+            batch_size=1000,
+            ignore_conflicts=True
+        )
+        for model, counter, source, field in COUNTERS:
+            updated = model.objects.exclude(
+                **{counter: expected_count(source, field)}
+            ).update(**{counter: expected_count(source, field)})
+            print('{}.{}: исправлено {}'.format(model.__name__,
+                                                counter,
+                                                updated))
+
+    def verify(self):
+        errors = []
+        missing = User.objects.filter(stats__isnull=True).count()
+        if missing:
+            errors.append('Нет счётчиков у пользователей: {}'.format(missing))
+        for model, counter, source, field in COUNTERS:
+            mismatched = model.objects.annotate(
+                expected=expected_count(source, field)
+            ).exclude(**{counter: F('expected')}).count()
+            if mismatched:
+                errors.append('{}.{}: расхождений {}'.format(
+                    model.__name__, counter, mismatched))
+        if errors:
+            raise CommandError('\n'.join(errors))
+        print('Счётчики совпадают с исходными данными')
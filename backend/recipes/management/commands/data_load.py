@@ -1,34 +1,189 @@
 import csv
+import io
+import json
 import os
+import time
 
 from django.core.management.base import BaseCommand
+from django.db import connection, transaction
 
+from recipes import catalogue
 from recipes.models import Ingredient
 
+MAX_LENGTH = 150
+HEADER = ['name', 'measurement_unit']
+READ_SIZE = 64 * 1024
+STAGING_TABLE = 'ingredient_import'
+CREATE_STAGING_SQL = '''
+    CREATE TEMPORARY TABLE IF NOT EXISTS {staging} (
+        name varchar({length}), measurement_unit varchar({length})
+    ) ON COMMIT DROP
+'''.format(staging=STAGING_TABLE, length=MAX_LENGTH)
+COPY_SQL = ('COPY {} (name, measurement_unit) FROM STDIN WITH (FORMAT csv)'
+            .format(STAGING_TABLE))
+MERGE_SQL = '''
+    INSERT INTO {table} (name, measurement_unit)
+    SELECT name, measurement_unit FROM {staging}
+    ON CONFLICT ON CONSTRAINT unique_ingredient DO NOTHING;
+    TRUNCATE {staging}
+'''.format(table=Ingredient._meta.db_table, staging=STAGING_TABLE)
+
+
+class DryRunRollback(Exception):
+    pass
+
+
+def read_csv(file):
+    """Строки CSV; первая пропускается, только если это заголовок."""
+    reader = csv.reader(file)
+    for number, row in enumerate(reader):
+        if (number == 0
+                and [value.strip().lower() for value in row[:2]] == HEADER):
+            continue
+        yield row[:2] if len(row) >= 2 else (None, None)
+
+
+def read_json(file):
+    """Объекты из JSON-массива по одному, без чтения файла целиком."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    while True:
+        chunk = file.read(READ_SIZE)
+        buffer = buffer[position:] + chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if not started:
+                if position == len(buffer):
+                    break
+                if buffer[position] != '[':
+                    raise ValueError('Ожидается JSON-массив')
+                started = True
+                position += 1
+                continue
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except ValueError:
+                if not chunk:
+                    raise
+                break
+            yield item.get('name'), item.get('measurement_unit')
+        if not chunk:
+            raise ValueError('JSON-массив не закрыт')
+
+
+READERS = {
+    '.csv': read_csv,
+    '.json': read_json,
+}
+
 
 class Command(BaseCommand):
+    help = 'Потоковая загрузка ингредиентов из CSV или JSON'
     FILE_PATH = os.path.join('data', 'ingredients.csv')
+    BATCH_SIZE = 5000
+
+    def add_arguments(self, parser):
+        parser.add_argument('path',
+                            nargs='?',
+                            default=self.FILE_PATH,
+                            help='Файл .csv или .json')
+        parser.add_argument('--batch-size',
+                            type=int,
+                            default=self.BATCH_SIZE)
+        parser.add_argument('--dry-run',
+                            action='store_true',
+                            help='Проверить файл без сохранения в БД')
 
     def handle(self, *args, **options):
-        if Ingredient.objects.exists():
-            print('Данные уже существуют!')
+        path = options['path']
+        reader = READERS.get(os.path.splitext(path)[1].lower())
+        if reader is None:
+            print('Поддерживаются файлы: {}'.format(', '.join(READERS)))
             return
 
         try:
-            self.data_loader()
+            with open(path, encoding='utf-8') as file:
+                stats = self.data_loader(reader(file),
+                                         options['batch_size'],
+                                         options['dry_run'])
         except FileNotFoundError:
-            print('Файл {} не найден'.format(self.FILE_PATH))
+            print('Файл {} не найден'.format(path))
         except Exception as err:
             print('Ошибка при импорте данных: {}'.format(err))
         else:
-            print('Данные успешно добавлены в БД!')
-
-    def data_loader(self):
-        with open(self.FILE_PATH, encoding='utf-8') as file:
-            reader = csv.reader(file)
-            next(reader)
-            ingredients = [Ingredient(
-                name=name,
-                measurement_unit=measurement_unit)
-                for name, measurement_unit in reader]
-            Ingredient.objects.bulk_create(ingredients)
+            print('{}: прочитано {}, добавлено {}, пропущено {}, '
+                  '{:.0f} строк/с'.format(
+                      'Проверка завершена' if options['dry_run']
+                      else 'Данные успешно добавлены в БД',
+                      *stats))
+
+    def data_loader(self, rows, batch_size, dry_run):
+        """Загружает строки порциями, пропуская уже существующие.
+
+        В PostgreSQL порция копируется через COPY во временную таблицу и
+        сливается в основную одним INSERT ... ON CONFLICT DO NOTHING, в
+        остальных СУБД используется bulk_create.
+        """
+        started = time.monotonic()
+        total = 0
+        count_before = Ingredient.objects.count()
+        use_copy = connection.vendor == 'postgresql'
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                if use_copy:
+                    cursor.execute(CREATE_STAGING_SQL)
+                batch = []
+                for name, measurement_unit in rows:
+                    total += 1
+                    name = (name or '').strip()
+                    measurement_unit = (measurement_unit or '').strip()
+                    if (not name or not measurement_unit
+                            or len(name) > MAX_LENGTH
+                            or len(measurement_unit) > MAX_LENGTH):
+                        continue
+                    batch.append((name, measurement_unit))
+                    if len(batch) == batch_size:
+                        self.save_batch(cursor if use_copy else None, batch)
+                        batch = []
+                        self.report(total, started)
+                self.save_batch(cursor if use_copy else None, batch)
+                added = Ingredient.objects.count() - count_before
+                if dry_run:
+                    raise DryRunRollback
+                if added:
+                    # Версия в базе фиксируется вместе с импортом, и
+                    # работающий сервер видит новый справочник без
+                    # перезапуска.
+                    catalogue.bump(catalogue.INGREDIENTS)
+        except DryRunRollback:
+            pass
+        elapsed = max(time.monotonic() - started, 1e-9)
+        return total, added, total - added, total / elapsed
+
+    @staticmethod
+    def save_batch(cursor, batch):
+        if not batch:
+            return
+        if cursor is None:
+            Ingredient.objects.bulk_create(
+                [Ingredient(name=name, measurement_unit=measurement_unit)
+                 for name, measurement_unit in batch],
+                ignore_conflicts=True
+            )
+            return
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(batch)
+        buffer.seek(0)
+        cursor.copy_expert(COPY_SQL, buffer)
+        cursor.execute(MERGE_SQL)
+
+    @staticmethod
+    def report(total, started):
+        print('Прочитано {}, {:.0f} строк/с'.format(
+            total, total / max(time.monotonic() - started, 1e-9)))
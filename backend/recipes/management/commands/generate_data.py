@@ -0,0 +1,268 @@
+import csv
+import io
+import random
+import time
+import uuid
+from datetime import timedelta
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from PIL import Image
+
+from recipes import catalogue
+from recipes.images import content_hash
+from recipes.models import (
+    SEARCH_VECTOR,
+    Favorite,
+    Ingredient,
+    IngredientToRecipe,
+    Recipe,
+    ShopList,
+    Tag
+)
+from users.models import Follow, User
+
+PASSWORD = 'fixture-password'
+DATE_RANGE = timedelta(days=365)
+
+
+def int_range(value):
+    """Диапазон вида 3-12 или одно число."""
+    low, _, high = value.partition('-')
+    try:
+        low = int(low)
+        high = int(high or low)
+    except ValueError:
+        raise CommandError('Ожидается диапазон вида 3-12: {}'.format(value))
+    if not 0 <= low <= high:
+        raise CommandError('Неверный диапазон: {}'.format(value))
+    return low, high
+
+
+def zipf_weights(count, skew):
+    """Накопленные веса закона Ципфа для random.choices."""
+    return list(accumulate(1 / rank ** skew for rank in range(1, count + 1)))
+
+
+def copy_rows(cursor, model, fields, rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cursor.copy_expert(
+        'COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(
+            model._meta.db_table,
+            ', '.join(model._meta.get_field(field).column
+                      for field in fields)),
+        buffer
+    )
+
+
+def allocate_ids(cursor, model, count):
+    """Резервирует count значений из последовательности первичного ключа."""
+    cursor.execute(
+        "SELECT nextval(pg_get_serial_sequence(%s, 'id')) "
+        'FROM generate_series(1, %s)',
+        [model._meta.db_table, count]
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+class Command(BaseCommand):
+    help = 'Генерация большого набора данных для нагрузочных тестов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--recipes', type=int, default=1000)
+        parser.add_argument('--tags', type=int, default=10,
+                            help='Сколько тегов должно быть в базе')
+        parser.add_argument('--ingredients-per-recipe', type=int_range,
+                            default=(3, 12))
+        parser.add_argument('--tags-per-recipe', type=int_range,
+                            default=(1, 3))
+        parser.add_argument('--favorites-per-user', type=float, default=10,
+                            help='Среднее, распределение экспоненциальное')
+        parser.add_argument('--cart-per-user', type=float, default=3,
+                            help='Среднее, распределение экспоненциальное')
+        parser.add_argument('--follows-per-user', type=float, default=5,
+                            help='Среднее, распределение экспоненциальное')
+        parser.add_argument('--skew', type=float, default=1.1,
+                            help='Показатель Ципфа для популярности авторов '
+                                 'и рецептов')
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--seed', type=int)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.now = timezone.now()
+        self.started = time.monotonic()
+        ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+        if not ingredient_ids:
+            raise CommandError('Сначала загрузите ингредиенты: data_load')
+
+        tag_ids = self.create_tags(options['tags'])
+        new_user_ids = self.create_users(options['users'])
+        user_ids = list(User.objects.values_list('id', flat=True))
+        self.random.shuffle(user_ids)
+        authors = (user_ids, zipf_weights(len(user_ids), options['skew']))
+
+        with connection.cursor() as cursor:
+            first_recipe_id = self.create_recipes(
+                cursor, options['recipes'], authors, ingredient_ids, tag_ids,
+                options['ingredients_per_recipe'], options['tags_per_recipe'])
+            recipe_ids = list(Recipe.objects.values_list('id', flat=True))
+            self.random.shuffle(recipe_ids)
+            recipes = (recipe_ids,
+                       zipf_weights(len(recipe_ids), options['skew']))
+            self.create_links(cursor, Favorite, ('user', 'recipe', 'added'),
+                              new_user_ids, recipes,
+                              options['favorites_per_user'])
+            self.create_links(cursor, ShopList, ('user', 'recipe', 'added'),
+                              new_user_ids, recipes,
+                              options['cart_per_user'])
+            self.create_links(cursor, Follow, ('user', 'author'),
+                              new_user_ids, authors,
+                              options['follows_per_user'])
+
+        self.report('Обновление производных данных')
+        if first_recipe_id is not None:
+            recipes = Recipe.objects.filter(id__gte=first_recipe_id)
+            recipes.update(search_vector=SEARCH_VECTOR)
+        call_command('counters')
+        call_command('shopping_cart_items')
+        catalogue.bump(catalogue.TAGS, catalogue.INGREDIENTS, catalogue.FEED,
+                       catalogue.FEED_ALL)
+        self.report('Готово')
+
+    def report(self, message):
+        print('[{:.1f} с] {}'.format(time.monotonic() - self.started,
+                                     message))
+
+    def random_date(self):
+        return self.now - DATE_RANGE * self.random.random()
+
+    def create_tags(self, count):
+        existing = set(Tag.objects.values_list('slug', flat=True))
+        colors = set(Tag.objects.values_list('color', flat=True))
+        tags = []
+        for number in range(count):
+            slug = 'tag{}'.format(number)
+            if slug in existing or len(existing) + len(tags) >= count:
+                continue
+            color = '#{:06X}'.format(self.random.randrange(0x1000000))
+            while color in colors:
+                color = '#{:06X}'.format(self.random.randrange(0x1000000))
+            colors.add(color)
+            tags.append(Tag(name='Тег {}'.format(number),
+                            color=color,
+                            slug=slug))
+        Tag.objects.bulk_create(tags, ignore_conflicts=True)
+        return list(Tag.objects.values_list('id', flat=True))
+
+    def create_users(self, count):
+        password = make_password(PASSWORD)
+        prefix = uuid.uuid4().hex[:8]
+        user_ids = []
+        for start in range(0, count, self.batch_size):
+            users = User.objects.bulk_create([
+                User(username='user_{}_{}'.format(prefix, number),
+                     email='user_{}_{}@example.com'.format(prefix, number),
+                     first_name='Имя {}'.format(number),
+                     last_name='Фамилия {}'.format(number),
+                     password=password)
+                for number in range(start,
+                                    min(start + self.batch_size, count))
+            ])
+            user_ids.extend(user.id for user in users)
+            self.report('Пользователей: {}'.format(len(user_ids)))
+        return user_ids
+
+    def placeholder_image(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (960, 720), (230, 180, 120)).save(buffer, 'PNG')
+        name = 'recipes/images/{}.png'.format(
+            content_hash(buffer.getvalue()))
+        storage = Recipe._meta.get_field('image').storage
+        return storage.save(name, ContentFile(buffer.getvalue()))
+
+    def create_recipes(self, cursor, count, authors, ingredient_ids, tag_ids,
+                       ingredients_per_recipe, tags_per_recipe):
+        if not count:
+            return None
+        image = self.placeholder_image()
+        author_ids, author_weights = authors
+        first_id = None
+        created = 0
+        while created < count:
+            size = min(self.batch_size, count - created)
+            recipe_ids = allocate_ids(cursor, Recipe, size)
+            if first_id is None:
+                first_id = recipe_ids[0]
+            copy_rows(cursor, Recipe,
+                      ('id', 'author', 'name', 'image', 'image_variants',
+                       'text', 'cooking_time', 'pub_date',
+                       'favorites_count', 'shop_list_count'),
+                      ((recipe_id,
+                        author_id,
+                        'Рецепт {}'.format(recipe_id),
+                        image,
+                        '{}',
+                        'Описание рецепта {}'.format(recipe_id),
+                        self.random.randint(1, 180),
+                        self.random_date(),
+                        0,
+                        0)
+                       for recipe_id, author_id in zip(
+                           recipe_ids,
+                           self.random.choices(author_ids,
+                                               cum_weights=author_weights,
+                                               k=size))))
+            copy_rows(cursor, IngredientToRecipe,
+                      ('recipe', 'ingredient', 'amount'),
+                      ((recipe_id, ingredient_id, self.random.randint(1, 500))
+                       for recipe_id in recipe_ids
+                       for ingredient_id in self.random.sample(
+                           ingredient_ids,
+                           min(len(ingredient_ids),
+                               self.random.randint(*ingredients_per_recipe)))))
+            copy_rows(cursor, Recipe.tags.through, ('recipe', 'tag'),
+                      ((recipe_id, tag_id)
+                       for recipe_id in recipe_ids
+                       for tag_id in self.random.sample(
+                           tag_ids,
+                           min(len(tag_ids),
+                               self.random.randint(*tags_per_recipe)))))
+            created += size
+            self.report('Рецептов: {}'.format(created))
+        return first_id
+
+    def create_links(self, cursor, model, fields, user_ids, targets, mean):
+        """Связи пользователей с популярными объектами, без повторов."""
+        target_ids, weights = targets
+        if not target_ids or not mean:
+            return
+        rows = []
+        created = 0
+        for user_id in user_ids:
+            count = int(self.random.expovariate(1 / mean))
+            chosen = set(self.random.choices(target_ids,
+                                             cum_weights=weights,
+                                             k=count))
+            chosen.discard(user_id if model is Follow else None)
+            for target_id in chosen:
+                row = (user_id, target_id)
+                rows.append(row + (self.random_date(),)
+                            if len(fields) == 3 else row)
+            if len(rows) >= self.batch_size:
+                copy_rows(cursor, model, fields, rows)
+                created += len(rows)
+                rows = []
+        copy_rows(cursor, model, fields, rows)
+        created += len(rows)
+        self.report('{}: {}'.format(model._meta.verbose_name_plural,
+                                    created))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes import images
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Уменьшенные копии для фото рецептов, загруженных до '
+            'обработки фото или без неё')
+
+    def handle(self, *args, **options):
+        names = sorted({
+            recipe.image.name
+            for recipe in Recipe.objects.exclude(image='').only(
+                'image', 'image_variants').iterator()
+            if not images.has_variants(recipe)
+        })
+        failed = []
+        for name in names:
+            try:
+                images.process(name)
+            except OSError as error:
+                failed.append('{}: {}'.format(name, error))
+        print('Обработано фото: {}'.format(len(names) - len(failed)))
+        if failed:
+            raise CommandError('Не удалось обработать:\n{}'.format(
+                '\n'.join(failed)))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from recipes import recommendations
+
+
+class Command(BaseCommand):
+    help = 'Пересчёт похожих рецептов для рекомендаций'
+
+    def handle(self, *args, **options):
+        count = recommendations.recompute()
+        print('Похожие рецепты пересчитаны, связей: {}'.format(count))
@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.models import ShoppingCartItem
+
+
+class Command(BaseCommand):
+    help = 'Пересчёт или проверка агрегата списков покупок'
+    BATCH_SIZE = 1000
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify',
+                            action='store_true',
+                            help='Только сравнить таблицу с исходными данными')
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            self.verify()
+        else:
+            self.rebuild()
+
+    @transaction.atomic
+    def rebuild(self):
+        ShoppingCartItem.objects.all().delete()
+        batch = []
+        created = 0
+        for user_id, ingredient_id, total_amount in (
+                ShoppingCartItem.objects.expected().iterator()):
+            batch.append(ShoppingCartItem(user_id=user_id,
+                                          ingredient_id=ingredient_id,
+                                          total_amount=total_amount))
+            if len(batch) == self.BATCH_SIZE:
+                ShoppingCartItem.objects.bulk_create(batch)
+                created += len(batch)
+                batch = []
+        ShoppingCartItem.objects.bulk_create(batch)
+        created += len(batch)
+        print('Списки покупок пересчитаны, позиций: {}'.format(created))
+
+    def verify(self):
+        expected = {
+            (user_id, ingredient_id): total_amount
+            for user_id, ingredient_id, total_amount in (
+                ShoppingCartItem.objects.expected().iterator())
+        }
+        actual = {
+            (user_id, ingredient_id): total_amount
+            for user_id, ingredient_id, total_amount in (
+                ShoppingCartItem.objects.values_list(
+                    'user_id', 'ingredient_id', 'total_amount'
+                ).iterator())
+        }
+        mismatches = [key for key in expected.keys() | actual.keys()
+                      if expected.get(key) != actual.get(key)]
+        if not mismatches:
+            print('Списки покупок совпадают с исходными данными')
+            return
+        for user_id, ingredient_id in mismatches[:20]:
+            print('Пользователь {}, ингредиент {}: ожидается {}, в таблице {}'
+                  .format(user_id,
+                          ingredient_id,
+                          expected.get((user_id, ingredient_id)),
+                          actual.get((user_id, ingredient_id))))
+        raise CommandError('Расхождений: {}'.format(len(mismatches)))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from recipes import trending
+
+
+class Command(BaseCommand):
+    help = 'Пересчёт рейтинга популярных сейчас рецептов'
+
+    def handle(self, *args, **options):
+        count = trending.recompute()
+        print('Рейтинг пересчитан, рецептов: {}'.format(count))
@@ -0,0 +1,51 @@
+# Generated by Django 3.2 on 2026-10-18 10:51
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_shopping_cart_items(apps, schema_editor):
+    IngredientToRecipe = apps.get_model('recipes', 'IngredientToRecipe')
+    ShoppingCartItem = apps.get_model('recipes', 'ShoppingCartItem')
+    totals = IngredientToRecipe.objects.filter(
+        recipe__shop_list__isnull=False
+    ).values_list('recipe__shop_list__user', 'ingredient'
+                  ).annotate(total_amount=models.Sum('amount')).order_by()
+    ShoppingCartItem.objects.bulk_create(
+        [ShoppingCartItem(user_id=user_id,
+                          ingredient_id=ingredient_id,
+                          total_amount=total_amount)
+         for user_id, ingredient_id, total_amount in totals.iterator()],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0002_auto_20230826_1958'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingCartItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_amount', models.IntegerField(verbose_name='Количество')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_cart_items', to='recipes.ingredient', verbose_name='Ингредиент')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_cart_items', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Позиция списка покупок',
+                'verbose_name_plural': 'Позиции списка покупок',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shoppingcartitem',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='unique_shopping_cart_item'),
+        ),
+        migrations.RunPython(fill_shopping_cart_items,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.2 on 2026-10-18 11:02
+
+from django.db import migrations, models
+import recipes.images
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_recipe_pub_date_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_variants',
+            field=models.JSONField(default=dict, editable=False, verbose_name='Уменьшенные копии фото'),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(storage=recipes.images.HashedStorage(), upload_to='recipes/images/', verbose_name='Фото'),
+        ),
+    ]
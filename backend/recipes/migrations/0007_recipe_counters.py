@@ -0,0 +1,46 @@
+# Generated by Django 3.2 on 2026-10-18 11:07
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def fill_recipe_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    for related, field in (('Favorite', 'favorites_count'),
+                           ('ShopList', 'shop_list_count')):
+        Model = apps.get_model('recipes', related)
+        Recipe.objects.update(**{field: Coalesce(
+            models.Subquery(
+                Model.objects.filter(
+                    recipe=models.OuterRef('pk')
+                ).order_by().values('recipe').annotate(
+                    count=models.Count('id')
+                ).values('count')
+            ),
+            0
+        )})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_recipe_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Добавлено в избранное'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='shop_list_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Добавлено в покупки'),
+        ),
+        migrations.RunPython(fill_recipe_counters, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-favorites_count', '-pub_date', '-id'], name='recipe_popular_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.2 on 2026-10-18 15:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_recipe_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogueVersion',
+            fields=[
+                ('name', models.CharField(max_length=150, primary_key=True, serialize=False, verbose_name='Справочник')),
+                ('version', models.BigIntegerField(verbose_name='Версия')),
+            ],
+            options={
+                'verbose_name': 'Версия справочника',
+                'verbose_name_plural': 'Версии справочников',
+            },
+        ),
+    ]
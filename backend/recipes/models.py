@@ -1,7 +1,23 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.lookups import PostgresOperatorLookup
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+    SearchVectorField
+)
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
+from django.db import connections, models
 
-from users.models import User
+from recipes import units
+from recipes.images import HashedStorage
+from users.models import Follow, User
+
+
+COMPUTED_FIELDS = frozenset(('favorites_count',
+                             'shop_list_count',
+                             'image_variants',
+                             'search_vector'))
 
 
 class Tag(models.Model):
@@ -42,6 +58,129 @@ class Ingredient(models.Model):
                                 self.measurement_unit)
 
 
+SEARCH_CONFIG = 'russian'
+SEARCH_VECTOR = (SearchVector('name', weight='A', config=SEARCH_CONFIG)
+                 + SearchVector('text', weight='B', config=SEARCH_CONFIG))
+
+
+@models.CharField.register_lookup
+class TrigramWordSimilar(PostgresOperatorLookup):
+    lookup_name = 'trigram_word_similar'
+    postgres_operator = '%%>'
+
+
+class TrigramWordSimilarity(models.Func):
+    function = 'WORD_SIMILARITY'
+    output_field = models.FloatField()
+
+    def __init__(self, string, expression, **extra):
+        super().__init__(models.Value(string), expression, **extra)
+
+
+def user_flag(queryset, user):
+    if not user.is_authenticated:
+        return models.Value(False, output_field=models.BooleanField())
+    return models.Exists(queryset.filter(user=user))
+
+
+def recipe_prefetches(user):
+    return (
+        models.Prefetch('tags',
+                        queryset=Tag.objects.order_by('id'),
+                        to_attr='prefetched_tags'),
+        models.Prefetch(
+            'ingredients_recipe',
+            queryset=IngredientToRecipe.objects.select_related(
+                'ingredient').order_by('id'),
+            to_attr='prefetched_ingredients'
+        ),
+        models.Prefetch(
+            'author',
+            queryset=User.objects.annotate(
+                is_subscribed=user_flag(
+                    Follow.objects.filter(author=models.OuterRef('pk')),
+                    user
+                )
+            )
+        )
+    )
+
+
+class RecipeQuerySet(models.QuerySet):
+    """План запросов для выдачи рецептов."""
+
+    def with_related(self, user):
+        return self.prefetch_related(*recipe_prefetches(user))
+
+    def search(self, value):
+        """Полнотекстовый поиск с подстраховкой по триграммам названия.
+
+        Без PostgreSQL ищется вхождение строки в название или описание.
+        """
+        if connections[self.db].vendor != 'postgresql':
+            return self.filter(models.Q(name__icontains=value)
+                               | models.Q(text__icontains=value))
+        query = SearchQuery(value,
+                            config=SEARCH_CONFIG,
+                            search_type='websearch')
+        return self.annotate(
+            rank=SearchRank(models.F('search_vector'), query),
+            similarity=TrigramWordSimilarity(value, 'name')
+        ).filter(
+            models.Q(search_vector=query)
+            | models.Q(name__trigram_word_similar=value)
+        ).order_by('-rank', '-similarity', '-pub_date')
+
+    def latest_per_author(self, limit=None):
+        if limit is None:
+            return self
+        return self.filter(id__in=models.Subquery(
+            Recipe.objects.filter(
+                author=models.OuterRef('author')
+            ).order_by('-pub_date', '-id').values('id')[:limit]
+        ))
+
+    def with_any_tag(self, tags):
+        return self.filter(models.Exists(
+            self.model.tags.through.objects.filter(
+                recipe=models.OuterRef('pk'),
+                tag__in=tags
+            )
+        ))
+
+    def with_all_tags(self, tags):
+        """Рецепты со всеми тегами.
+
+        Подходящие рецепты считаются по индексу (tag_id, recipe_id)
+        таблицы связи, без чтения самих рецептов.
+        """
+        tags = list(tags)
+        return self.filter(id__in=self.model.tags.through.objects.filter(
+            tag__in=tags
+        ).values('recipe').annotate(
+            tags_count=models.Count('tag')
+        ).filter(tags_count=len(tags)).values('recipe'))
+
+    def popular(self):
+        return self.order_by('-favorites_count', '-pub_date', '-id')
+
+    def trending(self):
+        return self.filter(score__isnull=False).order_by('-score__score',
+                                                         '-id')
+
+    def with_user_flags(self, user):
+        return self.annotate(
+            is_favorited=user_flag(
+                Favorite.objects.filter(recipe=models.OuterRef('pk')),
+                user
+            ),
+            is_in_shopping_cart=user_flag(
+                ShopList.objects.filter(recipe=models.OuterRef('pk')),
+                user
+            )
+        )
+
+
 class Recipe(models.Model):
     author = models.ForeignKey(User,
                                related_name='recipes',
@@ -50,7 +189,11 @@ class Recipe(models.Model):
     name = models.CharField('Название',
                             max_length=150)
     image = models.ImageField('Фото',
-                              upload_to='recipes/images/')
+                              upload_to='recipes/images/',
+                              storage=HashedStorage())
+    image_variants = models.JSONField('Уменьшенные копии фото',
+                                      default=dict,
+                                      editable=False)
     text = models.TextField('Описание')
     ingredients = models.ManyToManyField(Ingredient,
                                          through='IngredientToRecipe',
@@ -72,14 +215,59 @@ class Recipe(models.Model):
     pub_date = models.DateTimeField('Дата публикации',
                                     auto_now_add=True)
 
+    search_vector = SearchVectorField(null=True, editable=False)
+    favorites_count = models.PositiveIntegerField('Добавлено в избранное',
+                                                  default=0,
+                                                  editable=False)
+    shop_list_count = models.PositiveIntegerField('Добавлено в покупки',
+                                                  default=0,
+                                                  editable=False)
+
+    objects = RecipeQuerySet.as_manager()
+
     class Meta:
         ordering = ['-pub_date']
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='recipe_pub_date_id_idx'),
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='recipe_author_pub_date_idx'),
+            models.Index(fields=['-favorites_count', '-pub_date', '-id'],
+                         name='recipe_popular_idx'),
+            GinIndex(fields=['search_vector'],
+                     name='recipe_search_vector_idx'),
+            GinIndex(fields=['name'],
+                     name='recipe_name_trgm_idx',
+                     opclasses=['gin_trgm_ops'])]
 
     def __str__(self):
         return self.name
 
+    def save(self, force_insert=False, force_update=False, using=None,
+             update_fields=None):
+        """Сохраняет рецепт, не трогая вычисляемые столбцы.
+
+        Счётчики, копии фото и поисковый вектор меняются
+        отдельными запросами, поэтому при изменении рецепта без
+        update_fields они не перезаписываются значениями, загруженными
+        вместе с объектом.
+        """
+        if (update_fields is None and not force_insert
+                and not self._state.adding):
+            update_fields = [field.name
+                             for field in self._meta.concrete_fields
+                             if not field.primary_key
+                             and field.name not in COMPUTED_FIELDS]
+        super().save(force_insert=force_insert,
+                     force_update=force_update,
+                     using=using,
+                     update_fields=update_fields)
+        if connections[self._state.db].vendor == 'postgresql':
+            Recipe.objects.using(self._state.db).filter(pk=self.pk).update(
+                search_vector=SEARCH_VECTOR)
+
 
 class IngredientToRecipe(models.Model):
     recipe = models.ForeignKey(Recipe,
@@ -123,6 +311,9 @@ class ShopList(models.Model):
                                on_delete=models.CASCADE,
                                related_name='shop_list',
                                verbose_name='Рецепт')
+    added = models.DateTimeField('Дата добавления',
+                                 auto_now_add=True,
+                                 db_index=True)
 
     class Meta:
         verbose_name = 'Список покупок'
@@ -145,6 +336,9 @@ class Favorite(models.Model):
                                on_delete=models.CASCADE,
                                related_name='favorites',
                                verbose_name='Рецепты')
+    added = models.DateTimeField('Дата добавления',
+                                 auto_now_add=True,
+                                 db_index=True)
 
     class Meta:
         verbose_name = 'Избранное'
@@ -156,3 +350,159 @@ class Favorite(models.Model):
     def __str__(self):
         return '{} добавил {} в избранное'.format(self.user,
                                                   self.recipe.name)
+
+
+class RecipeScore(models.Model):
+    recipe = models.OneToOneField(Recipe,
+                                  on_delete=models.CASCADE,
+                                  primary_key=True,
+                                  related_name='score',
+                                  verbose_name='Рецепт')
+    score = models.FloatField('Рейтинг')
+
+    class Meta:
+        verbose_name = 'Рейтинг рецепта'
+        verbose_name_plural = 'Рейтинги рецептов'
+        indexes = [models.Index(fields=['-score', '-recipe'],
+                                name='recipe_score_idx')]
+
+    def __str__(self):
+        return '{}: {}'.format(self.recipe_id, self.score)
+
+
+class RecipeSimilarity(models.Model):
+    recipe = models.ForeignKey(Recipe,
+                               on_delete=models.CASCADE,
+                               related_name='similarities',
+                               verbose_name='Рецепт')
+    similar = models.ForeignKey(Recipe,
+                                on_delete=models.CASCADE,
+                                related_name='+',
+                                verbose_name='Похожий рецепт')
+    score = models.FloatField('Сходство')
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        constraints = [models.UniqueConstraint(
+            fields=['recipe', 'similar'],
+            name='unique_recipe_similarity')]
+        indexes = [models.Index(fields=['recipe', '-score'],
+                                name='recipe_similarity_score_idx')]
+
+    def __str__(self):
+        return '{} похож на {}'.format(self.recipe_id, self.similar_id)
+
+
+class ShoppingCartItemQuerySet(models.QuerySet):
+    """Инкрементальное обновление агрегата списка покупок."""
+
+    def apply_amounts(self, user_ids, amounts):
+        amounts = {ingredient_id: delta
+                   for ingredient_id, delta in amounts.items() if delta}
+        if not user_ids or not amounts:
+            return
+        self.bulk_create(
+            [self.model(user_id=user_id,
+                        ingredient_id=ingredient_id,
+                        total_amount=0)
+             for user_id in user_ids
+             for ingredient_id, delta in amounts.items() if delta > 0],
+            ignore_conflicts=True
+        )
+        items = self.filter(user_id__in=user_ids,
+                            ingredient_id__in=amounts)
+        items.update(total_amount=models.F('total_amount') + models.Case(
+            *[models.When(ingredient_id=ingredient_id, then=delta)
+              for ingredient_id, delta in amounts.items()],
+            default=0,
+            output_field=models.IntegerField()
+        ))
+        items.filter(total_amount__lte=0).delete()
+
+    def add_recipe(self, user_ids, recipe_id):
+        self.apply_amounts(user_ids, dict(
+            IngredientToRecipe.objects.filter(
+                recipe_id=recipe_id
+            ).values_list('ingredient_id', 'amount')
+        ))
+
+    def remove_recipe(self, user_ids, recipe_id):
+        self.apply_amounts(user_ids, {
+            ingredient_id: -amount
+            for ingredient_id, amount in IngredientToRecipe.objects.filter(
+                recipe_id=recipe_id
+            ).values_list('ingredient_id', 'amount')
+        })
+
+    def grouped(self):
+        """Позиции, сложенные по названию и базовой единице измерения.
+
+        Если все позиции группы в одной единице, её сумма остаётся в
+        amount, иначе используется base_amount в базовой единице.
+        """
+        field = 'ingredient__measurement_unit'
+        return self.annotate(
+            base_unit=units.base_unit(field)
+        ).values('ingredient__name', 'base_unit').annotate(
+            unit_count=models.Count(field, distinct=True),
+            unit=models.Max(field),
+            amount=models.Sum('total_amount'),
+            base_amount=models.Sum(models.F('total_amount')
+                                   * units.base_factor(field))
+        ).values_list('ingredient__name',
+                      'base_unit',
+                      'unit_count',
+                      'unit',
+                      'amount',
+                      'base_amount').order_by('ingredient__name',
+                                              'base_unit')
+
+    def expected(self):
+        return IngredientToRecipe.objects.filter(
+            recipe__shop_list__isnull=False
+        ).values_list('recipe__shop_list__user', 'ingredient'
+                      ).annotate(total_amount=models.Sum('amount')
+                                 ).order_by()
+
+
+class ShoppingCartItem(models.Model):
+    user = models.ForeignKey(User,
+                             on_delete=models.CASCADE,
+                             related_name='shopping_cart_items',
+                             verbose_name='Пользователь')
+    ingredient = models.ForeignKey(Ingredient,
+                                   on_delete=models.CASCADE,
+                                   related_name='shopping_cart_items',
+                                   verbose_name='Ингредиент')
+    total_amount = models.IntegerField('Количество')
+
+    objects = ShoppingCartItemQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Позиции списка покупок'
+        constraints = [models.UniqueConstraint(
+            fields=['user', 'ingredient'],
+            name='unique_shopping_cart_item')]
+
+    def __str__(self):
+        return '{} - {} {}'.format(self.user,
+                                   self.ingredient,
+                                   self.total_amount)
+
+
+class CatalogueVersion(models.Model):
+    """Версия справочника, общая для всех процессов сервера и команд."""
+
+    name = models.CharField('Справочник',
+                            primary_key=True,
+                            max_length=150)
+    version = models.BigIntegerField('Версия')
+
+    class Meta:
+        verbose_name = 'Версия справочника'
+        verbose_name_plural = 'Версии справочников'
+
+    def __str__(self):
+        return '{}: {}'.format(self.name, self.version)
@@ -0,0 +1,25 @@
+from django.db import migrations
+
+
+class PostgresOnlyMixin:
+    """Операция миграции выполняется только на PostgreSQL.
+
+    На других базах меняется только состояние моделей, например при
+    запуске тестов на SQLite.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state,
+                          to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_forwards(app_label, schema_editor, from_state,
+                                      to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state,
+                           to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(app_label, schema_editor, from_state,
+                                       to_state)
+
+
+class PostgresAddIndex(PostgresOnlyMixin, migrations.AddIndex):
+    pass
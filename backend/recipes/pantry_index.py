@@ -0,0 +1,94 @@
+import logging
+import threading
+import time
+from array import array
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections, connections
+
+from recipes import catalogue
+from recipes.models import IngredientToRecipe
+
+MIN_REBUILD_INTERVAL = 60
+
+logger = logging.getLogger(__name__)
+executor = ThreadPoolExecutor(max_workers=1,
+                              thread_name_prefix='pantry-index')
+
+
+class PantryIndex:
+    """Обратный индекс ингредиент -> рецепты для поиска по продуктам.
+
+    Для каждого ингредиента хранится отсортированный массив id рецептов,
+    для каждого рецепта - число его ингредиентов. Первый раз индекс
+    строится в запросе, а после изменения рецептов перестраивается в
+    фоне, не чаще раза в MIN_REBUILD_INTERVAL секунд. Пока идёт
+    перестройка, поиск работает по прежнему индексу.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._built_at = 0
+        self._rebuilding = None
+        self._data = ({}, {})
+
+    def search(self, ingredient_ids):
+        """Рецепты с найденными ингредиентами: (id, есть, не хватает).
+
+        Сначала идут рецепты, где не хватает меньше всего ингредиентов,
+        затем с большей долей найденных, затем более новые.
+        """
+        self._refresh()
+        postings, sizes = self._data
+        matched = Counter()
+        for ingredient_id in set(ingredient_ids):
+            matched.update(postings.get(ingredient_id, ()))
+        return sorted(
+            ((recipe_id, count, sizes[recipe_id] - count)
+             for recipe_id, count in matched.items()),
+            key=lambda item: (item[2],
+                              -item[1] / sizes[item[0]],
+                              -item[0])
+        )
+
+    def _refresh(self):
+        version = catalogue.get_version(catalogue.FEED_ALL)
+        if version == self._version:
+            return
+        with self._lock:
+            if version == self._version:
+                return
+            if self._version is None:
+                self._build(version)
+            elif ((self._rebuilding is None or self._rebuilding.done())
+                  and time.monotonic() - self._built_at
+                  >= MIN_REBUILD_INTERVAL):
+                self._rebuilding = executor.submit(self._rebuild, version)
+
+    def _rebuild(self, version):
+        close_old_connections()
+        try:
+            self._build(version)
+        except Exception:
+            logger.exception('Не удалось перестроить индекс продуктов')
+        finally:
+            connections.close_all()
+
+    def _build(self, version):
+        postings = {}
+        sizes = Counter()
+        for ingredient_id, recipe_id in IngredientToRecipe.objects.order_by(
+                'ingredient_id', 'recipe_id'
+        ).values_list('ingredient_id', 'recipe_id').iterator(chunk_size=10000):
+            if ingredient_id not in postings:
+                postings[ingredient_id] = array('q')
+            postings[ingredient_id].append(recipe_id)
+            sizes[recipe_id] += 1
+        self._data = (postings, dict(sizes))
+        self._version = version
+        self._built_at = time.monotonic()
+
+
+pantry_index = PantryIndex()
@@ -0,0 +1,162 @@
+import heapq
+import math
+from collections import defaultdict
+from itertools import groupby
+from operator import itemgetter
+
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from recipes.models import (
+    Favorite,
+    IngredientToRecipe,
+    Recipe,
+    RecipeSimilarity
+)
+
+TOP_K = 10
+CHUNK_SIZE = 1000
+MAX_POSTING = 5000
+RECOMMENDED_LIMIT = 20
+SOURCES = ((IngredientToRecipe, 'ingredient_id', 0.6),
+           (Favorite, 'user_id', 0.4))
+
+
+class Source:
+    """Бинарная матрица рецептов по одному источнику с весами по IDF.
+
+    В памяти держатся только веса столбцов, а строки матрицы читаются
+    из базы потоком по возрастанию id рецепта.
+    """
+
+    def __init__(self, model, column, weight):
+        self.model = model
+        self.column = column
+        self.weight = weight
+        sizes = dict(model.objects.values(column).annotate(
+            size=Count('recipe_id')
+        ).order_by().values_list(column, 'size'))
+        total = model.objects.order_by().values(
+            'recipe_id').distinct().count()
+        self.weights = {column: math.log(1 + total / size) ** 2
+                        for column, size in sizes.items()}
+        self.frequent = {column for column, size in sizes.items()
+                         if size > MAX_POSTING}
+
+    def rows(self, number, recipe_ids=None):
+        """Пары (id рецепта, номер источника, столбцы) по порядку id."""
+        pairs = self.model.objects.order_by('recipe_id')
+        if recipe_ids is not None:
+            pairs = pairs.filter(recipe_id__in=recipe_ids)
+        pairs = pairs.values_list('recipe_id', self.column).iterator(
+            chunk_size=CHUNK_SIZE)
+        for recipe_id, group in groupby(pairs, key=itemgetter(0)):
+            yield recipe_id, number, [column for _, column in group]
+
+    def norm(self, columns):
+        return math.sqrt(sum(self.weights.get(column, 0)
+                             for column in columns))
+
+
+def build_sources():
+    return [Source(*source) for source in SOURCES]
+
+
+def neighbours(sources, recipe_ids):
+    """Соседи порции рецептов за один проход по строкам всех матриц.
+
+    Индекс столбцов строится только по самой порции, поэтому память
+    ограничена её размером, а не числом связей в каталоге.
+    """
+    indexes = []
+    for number, source in enumerate(sources):
+        index = defaultdict(list)
+        norms = {}
+        for recipe_id, _, columns in source.rows(number, recipe_ids):
+            norms[recipe_id] = source.norm(columns)
+            for column in columns:
+                if column in source.weights and (
+                        column not in source.frequent):
+                    index[column].append(recipe_id)
+        indexes.append((index, norms))
+    tops = defaultdict(list)
+    rows = heapq.merge(
+        *(source.rows(number) for number, source in enumerate(sources)),
+        key=itemgetter(0))
+    for other, group in groupby(rows, key=itemgetter(0)):
+        scores = defaultdict(float)
+        for _, number, columns in group:
+            source = sources[number]
+            index, norms = indexes[number]
+            dots = defaultdict(float)
+            for column in columns:
+                for recipe_id in index.get(column, ()):
+                    dots[recipe_id] += source.weights[column]
+            if not dots:
+                continue
+            norm = source.norm(columns)
+            for recipe_id, dot in dots.items():
+                scores[recipe_id] += (
+                    source.weight * dot / (norms[recipe_id] * norm))
+        scores.pop(other, None)
+        for recipe_id, score in scores.items():
+            top = tops[recipe_id]
+            if len(top) < TOP_K:
+                heapq.heappush(top, (score, -other))
+            elif (score, -other) > top[0]:
+                heapq.heapreplace(top, (score, -other))
+    return {recipe_id: [(-other, score) for score, other in sorted(
+        top, reverse=True)] for recipe_id, top in tops.items()}
+
+
+@transaction.atomic
+def recompute():
+    """Пересчитывает похожие рецепты для всего каталога.
+
+    Соседи считаются и записываются порциями по CHUNK_SIZE рецептов:
+    на каждую порцию строки матриц читаются из базы заново, так что
+    память не растёт с числом рецептов и избранного.
+    """
+    sources = build_sources()
+    RecipeSimilarity.objects.all().delete()
+    created = 0
+    recipe_ids = Recipe.objects.order_by('id').values_list('id', flat=True)
+    chunk = []
+    for recipe_id in recipe_ids.iterator(chunk_size=CHUNK_SIZE):
+        chunk.append(recipe_id)
+        if len(chunk) == CHUNK_SIZE:
+            created += save_chunk(sources, chunk)
+            chunk = []
+    return created + save_chunk(sources, chunk)
+
+
+def save_chunk(sources, recipe_ids):
+    if not recipe_ids:
+        return 0
+    similarities = [
+        RecipeSimilarity(recipe_id=recipe_id, similar_id=other, score=score)
+        for recipe_id, top in neighbours(sources, recipe_ids).items()
+        for other, score in top
+    ]
+    RecipeSimilarity.objects.bulk_create(similarities)
+    return len(similarities)
+
+
+def similar_ids(recipe_id):
+    return list(RecipeSimilarity.objects.filter(
+        recipe_id=recipe_id
+    ).order_by('-score').values_list('similar_id', flat=True))
+
+
+def recommended_ids(user, limit=RECOMMENDED_LIMIT):
+    """Рецепты, похожие на избранное пользователя, кроме него самого."""
+    favorites = Favorite.objects.filter(user=user).values('recipe_id')
+    return list(RecipeSimilarity.objects.filter(
+        recipe__in=favorites
+    ).exclude(
+        similar__in=favorites
+    ).values('similar_id').annotate(
+        total=Sum('score')
+    ).order_by('-total', 'similar_id').values_list(
+        'similar_id', flat=True
+    )[:limit])
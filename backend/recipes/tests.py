@@ -0,0 +1,173 @@
+import io
+import os
+import tempfile
+from contextlib import redirect_stdout
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from PIL import Image
+
+from recipes import catalogue, images, recommendations
+from recipes.models import (
+    CatalogueVersion,
+    Ingredient,
+    IngredientToRecipe,
+    Recipe
+)
+from users.models import User
+
+
+class DataLoadTest(TestCase):
+    """Импорт ингредиентов из CSV и JSON."""
+
+    def load(self, path):
+        with redirect_stdout(io.StringIO()):
+            call_command('data_load', str(path))
+        return set(Ingredient.objects.values_list('name', 'measurement_unit'))
+
+    def load_csv(self, content):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'ingredients.csv')
+            with open(path, 'w', encoding='utf-8') as file:
+                file.write(content)
+            return self.load(path)
+
+    def test_csv_without_header(self):
+        self.assertEqual(self.load_csv('абрикосы,г\nсоль,по вкусу\n'),
+                         {('абрикосы', 'г'), ('соль', 'по вкусу')})
+
+    def test_csv_with_header(self):
+        self.assertEqual(
+            self.load_csv('name,measurement_unit\nабрикосы,г\n'),
+            {('абрикосы', 'г')})
+
+    def test_version_shared_with_server(self):
+        version = catalogue.get_version(catalogue.INGREDIENTS)
+        self.load_csv('абрикосы,г\n')
+        self.assertGreater(CatalogueVersion.objects.get(
+            name=catalogue.INGREDIENTS).version, version)
+
+    def test_catalogue_formats_match(self):
+        data = settings.BASE_DIR / 'data'
+        from_csv = self.load(data / 'ingredients.csv')
+        self.assertIn(('абрикосовое варенье', 'г'), from_csv)
+        Ingredient.objects.all().delete()
+        self.assertEqual(self.load(data / 'ingredients.json'), from_csv)
+
+
+class RecommendationsTest(TestCase):
+    """Похожие рецепты по общим ингредиентам."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(username='author',
+                                          email='author@ya.ru',
+                                          password='password')
+        ingredients = [Ingredient.objects.create(
+            name='Ингредиент {}'.format(i), measurement_unit='г')
+            for i in range(5)]
+        cls.recipes = []
+        for i, used in enumerate(('012', '012', '013', '4')):
+            recipe = Recipe.objects.create(author=author,
+                                           name='Рецепт {}'.format(i),
+                                           image='recipes/images/test.png',
+                                           text='Описание',
+                                           cooking_time=10)
+            IngredientToRecipe.objects.bulk_create([
+                IngredientToRecipe(recipe=recipe,
+                                   ingredient=ingredients[int(number)],
+                                   amount=100)
+                for number in used
+            ])
+            cls.recipes.append(recipe)
+
+    def test_recompute(self):
+        self.assertEqual(recommendations.recompute(), 6)
+        first, same, close, other = self.recipes
+        self.assertEqual(recommendations.similar_ids(first.id),
+                         [same.id, close.id])
+        self.assertEqual(recommendations.similar_ids(other.id), [])
+
+    def test_chunk_does_not_change_neighbours(self):
+        sources = recommendations.build_sources()
+        ids = [recipe.id for recipe in self.recipes]
+        together = recommendations.neighbours(sources, ids)
+        for recipe_id in ids[:3]:
+            self.assertEqual(
+                recommendations.neighbours(sources, [recipe_id])[recipe_id],
+                together[recipe_id])
+
+
+class RecipeImagesTest(TestCase):
+    """Хранение и обработка фото рецептов."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = override_settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.storage = Recipe._meta.get_field('image').storage
+
+    def photo(self):
+        """JPEG с поворотом в EXIF."""
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        buffer = io.BytesIO()
+        Image.new('RGB', (640, 320), (200, 120, 40)).save(
+            buffer, 'JPEG', quality=95, exif=exif.tobytes())
+        return buffer.getvalue()
+
+    def create_recipe(self, name):
+        author = User.objects.create_user(username='author',
+                                          email='author@ya.ru',
+                                          password='password')
+        return Recipe.objects.create(author=author,
+                                     name='Рецепт',
+                                     image=name,
+                                     text='Описание',
+                                     cooking_time=10)
+
+    def test_only_hashed_names_shared(self):
+        data = self.photo()
+        name = 'recipes/images/{}.jpg'.format(images.content_hash(data))
+        self.assertEqual(self.storage.save(name, ContentFile(data)), name)
+        self.assertEqual(self.storage.save(name, ContentFile(data)), name)
+        first = self.storage.save('recipes/images/photo.jpg',
+                                  ContentFile(b'first'))
+        second = self.storage.save('recipes/images/photo.jpg',
+                                   ContentFile(b'second'))
+        self.assertNotEqual(first, second)
+        with self.storage.open(first) as file:
+            self.assertEqual(file.read(), b'first')
+
+    def test_exif_removed_with_original_quality(self):
+        data = self.photo()
+        name = self.storage.save(
+            'recipes/images/{}.jpg'.format(images.content_hash(data)),
+            ContentFile(data))
+        recipe = self.create_recipe(name)
+        images.process(name)
+        with self.storage.open(name) as file:
+            processed = Image.open(file)
+            processed.load()
+        original = Image.open(io.BytesIO(data))
+        self.assertFalse(processed.getexif())
+        self.assertEqual(processed.size, (320, 640))
+        self.assertEqual(processed.quantization, original.quantization)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image_variants, images.variant_names(name))
+
+    def test_backfill_command(self):
+        name = self.storage.save('recipes/images/photo.jpg',
+                                 ContentFile(self.photo()))
+        recipe = self.create_recipe(name)
+        Recipe.objects.filter(id=recipe.id).update(image_variants={})
+        with redirect_stdout(io.StringIO()):
+            call_command('image_variants')
+        recipe.refresh_from_db()
+        self.assertTrue(images.has_variants(recipe))
+        for variant in recipe.image_variants.values():
+            self.assertTrue(self.storage.exists(variant))
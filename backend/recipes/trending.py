@@ -0,0 +1,46 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import models, transaction
+from django.db.models.functions import Extract, Power
+from django.utils import timezone
+
+from recipes.models import Favorite, RecipeScore, ShopList
+
+HALF_LIFE = timedelta(days=3)
+WINDOW = timedelta(days=30)
+WEIGHTS = ((Favorite, 1.0),
+           (ShopList, 0.5))
+
+
+def decayed_sum(now):
+    """Сумма событий, где вес каждого убывает вдвое за HALF_LIFE."""
+    age = models.ExpressionWrapper(
+        models.Value(now, output_field=models.DateTimeField())
+        - models.F('added'),
+        output_field=models.DurationField()
+    )
+    return models.Sum(Power(0.5,
+                            Extract(age, 'epoch')
+                            / HALF_LIFE.total_seconds()))
+
+
+@transaction.atomic
+def recompute(now=None):
+    """Пересчитывает таблицу рейтинга по событиям за последние WINDOW."""
+    now = now or timezone.now()
+    scores = defaultdict(float)
+    for model, weight in WEIGHTS:
+        for recipe_id, score in model.objects.filter(
+                added__gte=now - WINDOW
+        ).values_list('recipe').annotate(
+                score=decayed_sum(now)
+        ).order_by().iterator():
+            scores[recipe_id] += weight * score
+    RecipeScore.objects.all().delete()
+    RecipeScore.objects.bulk_create(
+        [RecipeScore(recipe_id=recipe_id, score=score)
+         for recipe_id, score in scores.items()],
+        batch_size=1000
+    )
+    return len(scores)
@@ -0,0 +1,44 @@
+from django.db import models
+
+# Единица измерения -> (базовая единица, сколько базовых в одной)
+CONVERSIONS = {
+    'г': ('г', 1),
+    'кг': ('г', 1000),
+    'мл': ('мл', 1),
+    'л': ('мл', 1000),
+    'ч. л.': ('мл', 5),
+    'ст. л.': ('мл', 15),
+    'стакан': ('мл', 250),
+}
+# Базовая единица -> (крупная единица, сколько базовых в одной)
+LARGER_UNITS = {
+    'г': ('кг', 1000),
+    'мл': ('л', 1000),
+}
+
+
+def base_unit(field):
+    return models.Case(
+        *[models.When(**{field: unit}, then=models.Value(base))
+          for unit, (base, _) in CONVERSIONS.items()],
+        default=models.F(field),
+        output_field=models.CharField()
+    )
+
+
+def base_factor(field):
+    return models.Case(
+        *[models.When(**{field: unit}, then=models.Value(factor))
+          for unit, (_, factor) in CONVERSIONS.items()],
+        default=models.Value(1),
+        output_field=models.IntegerField()
+    )
+
+
+def humanize(unit, amount):
+    """Количество в базовой единице в удобной записи: 1500 г -> 1.5 кг."""
+    if unit in LARGER_UNITS:
+        larger, factor = LARGER_UNITS[unit]
+        if amount >= factor:
+            return larger, '{:g}'.format(round(amount / factor, 2))
+    return unit, amount
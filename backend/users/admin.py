@@ -11,7 +11,10 @@ class UserAdmin(admin.ModelAdmin):
         'first_name',
         'last_name',
         'email',
+        'recipes_count',
+        'followers_count'
     )
+    list_select_related = ('stats',)
     search_fields = (
         'username',
         'email'
@@ -21,6 +24,15 @@ class UserAdmin(admin.ModelAdmin):
         'last_name'
     )
 
+    def recipes_count(self, obj):
+        return obj.stats.recipes_count
+
+    def followers_count(self, obj):
+        return obj.stats.followers_count
+
+    recipes_count.short_description = 'Рецептов'
+    followers_count.short_description = 'Подписчиков'
+
 
 class FollowAdmin(admin.ModelAdmin):
     list_display = (
@@ -0,0 +1,47 @@
+# Generated by Django 3.2 on 2026-10-18 11:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_author_stats(apps, schema_editor):
+    User = apps.get_model('auth', 'User')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Follow = apps.get_model('users', 'Follow')
+    AuthorStats = apps.get_model('users', 'AuthorStats')
+    recipes = dict(Recipe.objects.values_list('author').annotate(
+        models.Count('id')).order_by())
+    followers = dict(Follow.objects.values_list('author').annotate(
+        models.Count('id')).order_by())
+    AuthorStats.objects.bulk_create(
+        [AuthorStats(user_id=user_id,
+                     recipes_count=recipes.get(user_id, 0),
+                     followers_count=followers.get(user_id, 0))
+         for user_id in User.objects.values_list('id', flat=True).iterator()],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('recipes', '0001_initial'),
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthorStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='auth.user', verbose_name='Пользователь')),
+                ('recipes_count', models.PositiveIntegerField(default=0, verbose_name='Количество рецептов')),
+                ('followers_count', models.PositiveIntegerField(default=0, verbose_name='Количество подписчиков')),
+            ],
+            options={
+                'verbose_name': 'Счётчики автора',
+                'verbose_name_plural': 'Счётчики авторов',
+            },
+        ),
+        migrations.RunPython(fill_author_stats, migrations.RunPython.noop),
+    ]
@@ -24,3 +24,22 @@ class Follow(models.Model):
 
     def __str__(self):
         return '{} подписался на {}'.format(self.user, self.author)
+
+
+class AuthorStats(models.Model):
+    user = models.OneToOneField(User,
+                                on_delete=models.CASCADE,
+                                primary_key=True,
+                                related_name='stats',
+                                verbose_name='Пользователь')
+    recipes_count = models.PositiveIntegerField('Количество рецептов',
+                                                default=0)
+    followers_count = models.PositiveIntegerField('Количество подписчиков',
+                                                  default=0)
+
+    class Meta:
+        verbose_name = 'Счётчики автора'
+        verbose_name_plural = 'Счётчики авторов'
+
+    def __str__(self):
+        return 'Счётчики {}'.format(self.user)